@@ -8,6 +8,10 @@ echo "📊 Статус контейнера:"
 docker compose ps
 echo ""
 
+echo "🩺 Состояние бота:"
+docker compose exec -T tgbot python src/healthcheck.py --ready
+echo ""
+
 echo "💾 Использование ресурсов:"
 docker stats tgbot_manager --no-stream
 echo ""
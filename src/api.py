@@ -1,12 +1,24 @@
-import requests
-from datetime import datetime
-from typing import List, Dict, Optional
+import asyncio
 import json
+import os
 import time
-from logger_config import setup_logger
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Dict, Optional
+
+import aiohttp
+
+import metrics
+from ratelimit import TokenBucket
+from tracing import get_tracer
+from logger_config import log_payload, setup_logger
 
 logger = setup_logger(__name__)
 
+REQUESTS = metrics.counter('da_requests_total', 'Запросы к DonationAlerts API', ('endpoint', 'status'))
+REQUEST_SECONDS = metrics.histogram('da_request_seconds', 'Время запроса к DonationAlerts API', ('endpoint',))
+RETRIES = metrics.counter('da_retries_total', 'Повторные запросы к DonationAlerts API', ('endpoint', 'reason'))
+
 
 class DonationAlertsAPIException(Exception):
     pass
@@ -17,12 +29,27 @@ class DonationAlertsAuthException(DonationAlertsAPIException):
 class DonationAlertsRateLimitException(DonationAlertsAPIException):
     pass
 
+class DonationAlertsIncompleteFetchException(DonationAlertsAPIException):
+    def __init__(self, message: str, donations: List[Dict]):
+        super().__init__(message)
+        self.donations = donations
+
 class DonationAlertsAPI:
-    BASE_URL = "https://www.donationalerts.com/api/v1"
+    BASE_URL = os.getenv('DA_API_URL', "https://www.donationalerts.com/api/v1")
     MAX_RETRIES = 3
     RETRY_DELAY = 2
+    REQUEST_TIMEOUT = 30
+    CONNECTION_LIMIT = 10
+    RATE_LIMIT = float(os.getenv('DA_RATE_LIMIT', '2'))
+    RATE_BURST = int(os.getenv('DA_RATE_BURST', '4'))
+    PREFETCH_PAGES = int(os.getenv('DA_PREFETCH_PAGES', '4'))
 
-    def __init__(self, access_token: str):
+    def __init__(
+        self,
+        access_token: str,
+        rate_limit: Optional[float] = None,
+        prefetch_pages: Optional[int] = None
+    ):
         if not access_token or not access_token.strip():
             logger.error("Попытка инициализации API с пустым токеном")
             raise ValueError("Access token не может быть пустым")
@@ -32,67 +59,96 @@ class DonationAlertsAPI:
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json"
         }
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.limiter = TokenBucket(rate_limit or self.RATE_LIMIT, self.RATE_BURST)
+        self.prefetch_pages = max(1, prefetch_pages or self.PREFETCH_PAGES)
         logger.info("DonationAlertsAPI инициализирован")
 
-    def _handle_response(self, response: requests.Response) -> Dict:
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.REQUEST_TIMEOUT),
+                connector=aiohttp.TCPConnector(limit=self.CONNECTION_LIMIT)
+            )
+            logger.debug("Создана HTTP-сессия DonationAlerts")
+        return self._session
+
+    @asynccontextmanager
+    async def _request(self, method: str, endpoint: str, **kwargs):
+        session = self._get_session()
+        await self.limiter.acquire()
+        # Ожидание лимитера не входит во время запроса, статус 'error' - сетевая ошибка или таймаут
+        started = time.perf_counter()
+        status = 'error'
+        with get_tracer().span(f"da.{endpoint}", method=method) as span:
+            try:
+                async with session.request(method, f"{self.BASE_URL}{endpoint}", **kwargs) as response:
+                    status = str(response.status)
+                    if span is not None:
+                        span.set(status=response.status)
+                    yield response
+            finally:
+                REQUESTS.labels(endpoint, status).inc()
+                REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-сессия DonationAlerts закрыта")
+        self._session = None
+
+    async def _handle_response(self, response: aiohttp.ClientResponse) -> Dict:
+        status_code = response.status
+        body = await response.text()
+        log_payload(logger, "Response body", body)
+
+        if status_code == 401:
+            logger.error(f"Ошибка аутентификации (401): неверный или истекший токен")
+            raise DonationAlertsAuthException(
+                "Ошибка аутентификации: неверный или истекший токен"
+            )
+        elif status_code == 403:
+            logger.error(f"Доступ запрещён (403): недостаточно прав")
+            raise DonationAlertsAuthException(
+                "Доступ запрещён: недостаточно прав"
+            )
+        elif status_code == 429:
+            logger.warning(f"Превышен лимит запросов к API (429)")
+            raise DonationAlertsRateLimitException(
+                "Превышен лимит запросов к API"
+            )
+        elif status_code >= 500:
+            logger.error(f"Ошибка сервера DonationAlerts ({status_code})")
+            raise DonationAlertsAPIException(
+                f"Ошибка сервера DonationAlerts ({status_code})"
+            )
+        elif status_code >= 400:
+            logger.error(f"Ошибка API ({status_code}): {response.reason}")
+            raise DonationAlertsAPIException(
+                f"Ошибка API ({status_code}): {response.reason}"
+            )
+
         try:
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            status_code = response.status_code
-
-            if status_code == 401:
-                logger.error(f"Ошибка аутентификации (401): неверный или истекший токен")
-                raise DonationAlertsAuthException(
-                    "Ошибка аутентификации: неверный или истекший токен"
-                ) from e
-            elif status_code == 403:
-                logger.error(f"Доступ запрещён (403): недостаточно прав")
-                raise DonationAlertsAuthException(
-                    "Доступ запрещён: недостаточно прав"
-                ) from e
-            elif status_code == 429:
-                logger.warning(f"Превышен лимит запросов к API (429)")
-                raise DonationAlertsRateLimitException(
-                    "Превышен лимит запросов к API"
-                ) from e
-            elif status_code >= 500:
-                logger.error(f"Ошибка сервера DonationAlerts ({status_code})")
-                raise DonationAlertsAPIException(
-                    f"Ошибка сервера DonationAlerts ({status_code})"
-                ) from e
-            else:
-                logger.error(f"Ошибка API ({status_code}): {e}")
-                raise DonationAlertsAPIException(
-                    f"Ошибка API ({status_code}): {e}"
-                ) from e
-        except requests.exceptions.JSONDecodeError as e:
+            return json.loads(body)
+        except json.JSONDecodeError as e:
             logger.error(f"Не удалось разобрать ответ от API: {e}")
             raise DonationAlertsAPIException(
                 "Не удалось разобрать ответ от API"
             ) from e
     
-    def get_donations(self, page: int = 1, retry_count: int = 0) -> Optional[Dict]:
-        url = f"{self.BASE_URL}/alerts/donations"
+    async def get_donations(self, page: int = 1, retry_count: int = 0) -> Optional[Dict]:
         params = {"page": page}
         
         try:
-            logger.debug(f"Запрос донатов: страница {page}, попытка {retry_count + 1}")
-            response = requests.get(
-                url, 
-                headers=self.headers, 
-                params=params,
-                timeout=30
-            )
+            logger.debug("Запрос донатов: страница %s, попытка %s", page, retry_count + 1)
+            async with self._request('GET', '/alerts/donations', params=params) as response:
+                # debug: что ушло
+                logger.debug("Request url: %s", response.request_info.url)
 
-            # debug: что ушло
-            logger.debug("Request headers: %s", response.request.headers)
-            logger.debug("Request url: %s", response.request.url)
-
-            # debug: что вернулось
-            logger.debug("Response status: %s", response.status_code)
-            logger.debug("Response body: %s", response.text)
-            return self._handle_response(response)
+                # debug: что вернулось
+                logger.debug("Response status: %s", response.status)
+                return await self._handle_response(response)
         
         except DonationAlertsAuthException:
             raise
@@ -100,96 +156,144 @@ class DonationAlertsAPI:
         except DonationAlertsRateLimitException as e:
             if retry_count < self.MAX_RETRIES:
                 wait_time = self.RETRY_DELAY * (2 ** retry_count)
+                RETRIES.labels('/alerts/donations', 'rate_limit').inc()
                 logger.warning(f"Rate limit достигнут. Ожидание {wait_time} секунд...")
-                time.sleep(wait_time)
-                return self.get_donations(page, retry_count + 1)
+                await asyncio.sleep(wait_time)
+                return await self.get_donations(page, retry_count + 1)
             else:
                 logger.error(f"Превышено количество попыток при rate limit")
                 raise
 
-        except (requests.exceptions.RequestException, DonationAlertsAPIException) as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError, DonationAlertsAPIException) as e:
             if retry_count < self.MAX_RETRIES:
-                logger.warning(f"Ошибка при запросе (попытка {retry_count + 1}/{self.MAX_RETRIES}): {e}")
-                time.sleep(self.RETRY_DELAY)
-                return self.get_donations(page, retry_count + 1)
+                RETRIES.labels('/alerts/donations', 'error').inc()
+                logger.warning(f"Ошибка при запросе (попытка {retry_count + 1}/{self.MAX_RETRIES}): {e!r}")
+                await asyncio.sleep(self.RETRY_DELAY)
+                return await self.get_donations(page, retry_count + 1)
             else:
-                logger.error(f"Критическая ошибка после {self.MAX_RETRIES} попыток: {e}")
+                logger.error(f"Критическая ошибка после {self.MAX_RETRIES} попыток: {e!r}")
                 return None
     
 
-    def get_all_donations_in_range(
+    async def get_user(self) -> Dict:
+        async with self._request('GET', '/user/oauth') as response:
+            return (await self._handle_response(response)).get('data', {})
+
+    async def subscribe_channels(self, channels: List[str], client_id: str) -> Dict[str, str]:
+        payload = {"channels": channels, "client": client_id}
+        async with self._request('POST', '/centrifuge/subscribe', json=payload) as response:
+            data = await self._handle_response(response)
+        return {item['channel']: item['token'] for item in data.get('channels', [])}
+
+    async def get_all_donations_in_range(
         self, 
         start_date: Optional[datetime] = None, 
-        end_date: Optional[datetime] = None
+        end_date: Optional[datetime] = None,
+        prefetch: Optional[int] = None,
+        after_id: Optional[int] = None
     ) -> List[Dict]:
         
-        logger.info(f"Начало загрузки донатов за период: {start_date} - {end_date}")
+        prefetch = self.prefetch_pages if prefetch is None else max(1, prefetch)
+        logger.info(
+            f"Начало загрузки донатов за период: {start_date} - {end_date} "
+            f"(после ID {after_id}, prefetch={prefetch})"
+        )
         all_donations = []
+        pending: Dict[int, asyncio.Task] = {}
         page = 1
+        last_page = None
         consecutive_errors = 0
         MAX_CONSECUTIVE_ERRORS = 3
+        incomplete = None
         
-        while True:
-            logger.info(f"Загрузка страницы {page}...")
-            
-            try:
-                data = self.get_donations(page)
+        try:
+            while True:
+                # Пока номер последней страницы неизвестен, страницы грузятся по одной
+                window_end = min(page + prefetch - 1, last_page) if last_page else page
+                for next_page in range(page, window_end + 1):
+                    if next_page not in pending:
+                        pending[next_page] = asyncio.create_task(self.get_donations(next_page))
 
-                if data is None:
-                    consecutive_errors += 1
-                    if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
-                        logger.error(f"Прекращение загрузки после {MAX_CONSECUTIVE_ERRORS} последовательных ошибок")
+                logger.info(f"Загрузка страницы {page}...")
+                
+                try:
+                    data = await pending.pop(page)
+
+                    if data is None:
+                        consecutive_errors += 1
+                        if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                            logger.error(f"Прекращение загрузки после {MAX_CONSECUTIVE_ERRORS} последовательных ошибок")
+                            incomplete = f"страница {page} не загружена после {MAX_CONSECUTIVE_ERRORS} попыток"
+                            break
+                        continue
+
+                    consecutive_errors = 0
+                    
+                    if 'data' not in data:
+                        logger.warning(f"Отсутствует поле 'data' в ответе API")
+                        incomplete = f"в ответе для страницы {page} нет поля 'data'"
+                        break
+                    
+                    donations = data['data']
+                    
+                    if not donations:
+                        logger.info("Достигнут конец списка донатов")
                         break
-                    continue
 
-                consecutive_errors = 0
-                
-                if 'data' not in data:
-                    logger.warning(f"Отсутствует поле 'data' в ответе API")
-                    break
-                
-                donations = data['data']
-                
-                if not donations:
-                    logger.info("Достигнут конец списка донатов")
-                    break
-                
-                for donation in donations:
-                    try:
-                        donation_date = datetime.fromisoformat(
-                            donation['created_at'].replace('Z', '+00:00')
-                        )
-                        
-                        if start_date and donation_date < start_date:
-                            logger.info(f"Достигнута начальная дата ({start_date}), прекращаем загрузку")
+                    if last_page is None:
+                        last_page = data.get('meta', {}).get('last_page')
+                    
+                    for donation in donations:
+                        if after_id is not None and donation.get('id', 0) <= after_id:
+                            logger.info(f"Достигнут уже загруженный донат (ID {after_id}), прекращаем загрузку")
                             return all_donations
-                        
-                        if end_date and donation_date > end_date:
+
+                        try:
+                            donation_date = datetime.fromisoformat(
+                                donation['created_at'].replace('Z', '+00:00')
+                            )
+                            
+                            if start_date and donation_date < start_date:
+                                logger.info(f"Достигнута начальная дата ({start_date}), прекращаем загрузку")
+                                return all_donations
+                            
+                            if end_date and donation_date > end_date:
+                                continue
+                            
+                            if (not start_date or donation_date >= start_date) and (not end_date or donation_date <= end_date):
+                                all_donations.append(donation)
+
+                        except (KeyError, ValueError) as e:
+                            logger.error(f"Ошибка обработки доната: {e}, данные: {donation}")
                             continue
-                        
-                        if (not start_date or donation_date >= start_date) and (not end_date or donation_date <= end_date):
-                            all_donations.append(donation)
+                    
+                    links = data.get('links', {})
+                    if not links.get('next'):
+                        logger.info("Достигнута последняя страница")
+                        break
+                    
+                    page += 1
 
-                    except (KeyError, ValueError) as e:
-                        logger.error(f"Ошибка обработки доната: {e}, данные: {donation}")
-                        continue
-                
-                links = data.get('links', {})
-                if not links.get('next'):
-                    logger.info("Достигнута последняя страница")
-                    break
-                
-                page += 1
-                time.sleep(0.5)
+                except DonationAlertsAuthException:
+                    raise
+                except Exception as e:
+                    logger.error(f"Неожиданная ошибка при обработке страницы {page}: {e}", exc_info=True)
+                    consecutive_errors += 1
+                    if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                        logger.error(f"Прекращение после {MAX_CONSECUTIVE_ERRORS} ошибок")
+                        incomplete = f"страница {page} не обработана: {e!r}"
+                        break
+        finally:
+            for task in pending.values():
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending.values(), return_exceptions=True)
 
-            except DonationAlertsAuthException:
-                raise
-            except Exception as e:
-                logger.error(f"Неожиданная ошибка при обработке страницы {page}: {e}", exc_info=True)
-                consecutive_errors += 1
-                if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
-                    logger.error(f"Прекращение после {MAX_CONSECUTIVE_ERRORS} ошибок")
-                    break
+        if incomplete:
+            # Страницы идут от новых к старым: без недостающих страниц нельзя считать период загруженным
+            raise DonationAlertsIncompleteFetchException(
+                f"Загрузка донатов прервана ({incomplete}), получено {len(all_donations)}", all_donations
+            )
         
         logger.info(f"Всего загружено донатов: {len(all_donations)}")
         return all_donations
@@ -215,3 +319,21 @@ class DonationAlertsAPI:
         except IOError as e:
             logger.error(f"Ошибка при сохранении файла: {e}", exc_info=True)
             raise
+
+
+_clients: Dict[str, DonationAlertsAPI] = {}
+
+
+def get_api(access_token: str) -> DonationAlertsAPI:
+    key = (access_token or '').strip()
+    api = _clients.get(key)
+    if api is None:
+        api = DonationAlertsAPI(key)
+        _clients[key] = api
+    return api
+
+
+async def close_api_clients():
+    for api in list(_clients.values()):
+        await api.close()
+    _clients.clear()
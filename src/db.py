@@ -1,13 +1,98 @@
+import asyncio
+import contextvars
 import os
 import sqlite3
-from pathlib import Path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from contextlib import contextmanager
-from api import DonationAlertsAPI
+from typing import NamedTuple, Optional
+import metrics
+from api import DonationAlertsIncompleteFetchException, get_api
+from profiler import get_profiler, profiled
+from tracing import get_tracer
+from db_connection import SQLiteConnectionManager, get_connection_manager, close_connections
+from usernames import normalize_username, username_key, username_keys
+from tariffs import calculate_expiry, calculate_expiries
+from subscription_index import SubscriptionIndex
 from logger_config import setup_logger
 
 logger = setup_logger(__name__)
 
+INITIAL_SYNC_WINDOW = timedelta(hours=int(os.getenv('INITIAL_SYNC_HOURS', '1')))
+SLOW_QUERY_SECONDS = float(os.getenv('DB_SLOW_QUERY_MS', '200')) / 1000
+
+
+BATCH_CHUNK_SIZE = 500
+
+BATCH_ROWS = metrics.counter('donations_saved_total', 'Донаты, обработанные save_donations_batch', ('result',))
+BATCH_SECONDS = metrics.histogram(
+    'donations_batch_seconds', 'Время пакетного сохранения донатов',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+QUERY_SECONDS = metrics.histogram('db_query_seconds', 'Время выполнения запроса к БД', ('pool', 'query'))
+QUERY_WAIT_SECONDS = metrics.histogram('db_queue_wait_seconds', 'Ожидание свободного потока БД', ('pool',))
+
+_UPSERT_SET_SQL = '''
+    DO UPDATE SET
+        amount = amount + excluded.amount,
+        last_date = excluded.last_date,
+        sub = excluded.sub,
+        expires_at = excluded.expires_at,
+        enforcement_state = CASE
+            WHEN enforcement_state = 'removed' AND excluded.expires_at > CAST(strftime('%s', 'now') AS INTEGER)
+            THEN 'reinstated' ELSE enforcement_state END,
+        state_changed_at = CASE
+            WHEN enforcement_state = 'removed' AND excluded.expires_at > CAST(strftime('%s', 'now') AS INTEGER)
+            THEN CAST(strftime('%s', 'now') AS INTEGER) ELSE state_changed_at END,
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+UPSERT_BY_USERNAME_SQL = '''
+    INSERT INTO donations (message, username, amount, last_date, sub, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(username) WHERE username IS NOT NULL
+''' + _UPSERT_SET_SQL
+
+UPSERT_BY_MESSAGE_SQL = '''
+    INSERT INTO donations (message, username, amount, last_date, sub, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(message)
+''' + _UPSERT_SET_SQL
+
+
+SUBSCRIPTION_COLUMNS = 'id, username, message, amount, last_date, sub, expires_at'
+
+STATE_ACTIVE = 'active'
+STATE_REMOVED = 'removed'
+STATE_REINSTATED = 'reinstated'
+
+
+class Subscription(NamedTuple):
+    id: int
+    username: Optional[str]
+    message: str
+    amount: float
+    last_date: str
+    sub: Optional[str]
+    expires_at: Optional[int]
+
+
+def _sub_timestamp(sub):
+    if not sub:
+        return None
+
+    try:
+        return datetime.fromisoformat(str(sub).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        logger.warning(f"Некорректная дата подписки: {sub}")
+        return None
+
+
+def _expires_at(sub):
+    timestamp = _sub_timestamp(sub)
+    return int(timestamp) if timestamp is not None else None
+
 
 class DonationDB:
     def __init__(self, db_path=None):
@@ -15,11 +100,13 @@ class DonationDB:
             db_path = os.getenv('DB_PATH', '/app/data/donations.db')
 
         self.db_path = db_path
-
-        logger.info(f"Инициализация БД: {db_path}")
-        self._init_database()
+        self._listeners = []
+        self._user_listeners = []
+        self._connections = get_connection_manager(db_path)
+        self._connections.ensure_schema(self._init_database)
     
     def _init_database(self):
+        logger.info(f"Инициализация БД: {self.db_path}")
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
@@ -33,175 +120,564 @@ class DonationDB:
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS processed_donations (
+                    donation_id INTEGER PRIMARY KEY,
+                    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
             conn.commit()
+            self._migrate(conn)
         logger.info("База данных инициализирована")
+
+    def _migrations(self):
+        return [
+            self._migrate_username_column,
+            self._migrate_expires_at_column,
+            self._migrate_stats_summary,
+            self._migrate_telegram_users,
+            self._migrate_enforcement_state,
+            self._migrate_invite_links,
+        ]
+
+    def _migrate(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+
+        for target, migration in enumerate(self._migrations(), start=1):
+            if version >= target:
+                continue
+
+            logger.info(f"Применение миграции БД #{target}: {migration.__name__}")
+            cursor.execute('BEGIN')
+            try:
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {target}')
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                logger.error(f"Ошибка миграции БД #{target}", exc_info=True)
+                raise
+
+    def _migrate_username_column(self, cursor):
+        cursor.execute('ALTER TABLE donations ADD COLUMN username TEXT')
+        cursor.execute('SELECT id, message, amount, last_date, sub FROM donations ORDER BY id')
+
+        records = cursor.fetchall()
+        groups = {}
+        for row, username in zip(records, username_keys(row[1] for row in records)):
+            if username:
+                groups.setdefault(username, []).append(row)
+
+        merged = 0
+        for username, rows in groups.items():
+            keep_id = rows[0][0]
+
+            if len(rows) > 1:
+                amount = sum(row[2] for row in rows)
+                last_date = max((row[3] for row in rows), key=lambda value: value or '')
+                sub = max((row[4] for row in rows), key=lambda value: _sub_timestamp(value) or 0)
+                cursor.execute(
+                    'UPDATE donations SET amount = ?, last_date = ?, sub = ? WHERE id = ?',
+                    (amount, last_date, sub, keep_id)
+                )
+                cursor.executemany(
+                    'DELETE FROM donations WHERE id = ?',
+                    [(row[0],) for row in rows[1:]]
+                )
+                merged += len(rows) - 1
+
+            cursor.execute('UPDATE donations SET username = ? WHERE id = ?', (username, keep_id))
+
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_donations_username
+            ON donations(username) WHERE username IS NOT NULL
+        ''')
+        logger.info(f"Заполнен username для {len(groups)} записей, объединено дублей: {merged}")
+
+    def _migrate_expires_at_column(self, cursor):
+        cursor.execute('ALTER TABLE donations ADD COLUMN expires_at INTEGER')
+        cursor.execute('SELECT id, sub FROM donations WHERE sub IS NOT NULL')
+        updates = [(_expires_at(sub), donation_id) for donation_id, sub in cursor.fetchall()]
+        cursor.executemany('UPDATE donations SET expires_at = ? WHERE id = ?', updates)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_donations_expires_at ON donations(expires_at)')
+        logger.info(f"Заполнен expires_at для {len(updates)} записей")
+
+    def _migrate_stats_summary(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_summary (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_users INTEGER NOT NULL,
+                total_amount REAL NOT NULL,
+                expired_users INTEGER NOT NULL,
+                counted_until INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS expiry_histogram (
+                day INTEGER PRIMARY KEY,
+                users INTEGER NOT NULL
+            )
+        ''')
+        self._rebuild_stats_summary(cursor)
+
+    def _migrate_telegram_users(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS telegram_users (
+                username TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL UNIQUE,
+                last_seen INTEGER NOT NULL
+            )
+        ''')
+
+    def _migrate_enforcement_state(self, cursor):
+        # Существующие записи начинают как active: первая проверка после миграции
+        # обработает накопленные истекшие подписки один раз, дальше только новые
+        cursor.execute(f"ALTER TABLE donations ADD COLUMN enforcement_state TEXT NOT NULL DEFAULT '{STATE_ACTIVE}'")
+        cursor.execute('ALTER TABLE donations ADD COLUMN state_changed_at INTEGER')
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_donations_pending_removal
+            ON donations(expires_at) WHERE enforcement_state != '{STATE_REMOVED}'
+        ''')
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_donations_reinstated
+            ON donations(expires_at) WHERE enforcement_state = '{STATE_REINSTATED}'
+        ''')
     
-    @contextmanager
+    def _migrate_invite_links(self, cursor):
+        # active - выданная пользователю ссылка, stale - заменённая или использованная, ожидает отзыва
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS invite_links (
+                invite_link TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                expires_at INTEGER NOT NULL,
+                created_at INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'active'
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_invite_links_active_user
+            ON invite_links(user_id) WHERE state = 'active'
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_invite_links_expires_at ON invite_links(expires_at)')
+
     def _get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        try:
-            yield conn
-        finally:
-            conn.close()
+        return self._connections.writer()
 
-    def _calculate_sub_date(self, base_date, amount):
-        months_to_add = int(amount // 200)
-        logger.debug(f"Расчет даты подписки: база={base_date}, сумма={amount}, месяцев={months_to_add}")
-
-        if isinstance(base_date, str):
-            base_date = datetime.fromisoformat(base_date.replace('Z', '+00:00'))
-        elif not isinstance(base_date, datetime):
-            base_date = datetime.now()
-
-        new_date = base_date
-        for _ in range(months_to_add):
-            month = new_date.month
-            year = new_date.year
-
-            if month == 12:
-                month = 1
-                year += 1
-            else:
-                month += 1
+    def _read_connection(self):
+        return self._connections.reader()
 
-            day = min(new_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month - 1])
+    def add_listener(self, callback):
+        self._listeners.append(callback)
 
-            new_date = new_date.replace(year=year, month=month, day=day)
+    def add_user_listener(self, callback):
+        self._user_listeners.append(callback)
 
-        return new_date.isoformat()
+    def _publish(self, cursor, chunk):
+        if not self._listeners:
+            return
+
+        subscriptions = []
+        for column in ('username', 'message'):
+            values = [group[column] for group in chunk if bool(group['username']) == (column == 'username')]
+            if not values:
+                continue
+            placeholders = ','.join('?' * len(values))
+            cursor.execute(
+                f'SELECT {SUBSCRIPTION_COLUMNS} FROM donations WHERE {column} IN ({placeholders})',
+                values
+            )
+            subscriptions.extend(Subscription(*row) for row in cursor.fetchall())
+
+        for listener in self._listeners:
+            try:
+                listener(subscriptions)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике изменений подписок: {e}", exc_info=True)
+
+    def close(self):
+        # Соединения общие для процесса и закрываются через db_connection.close_connections()
+        pass
+
+    def _calculate_sub_date(self, base_date, amount):
+        logger.debug("Расчет даты подписки: база=%s, сумма=%s", base_date, amount)
+        return calculate_expiry(base_date, amount).isoformat()
     
     def save_donation(self, message, amount, last_date):
-        try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute(
-                    'SELECT id, amount, sub FROM donations WHERE message = ?',
-                    (message,)
-                )
-                existing = cursor.fetchone()
-                
-                if existing:
-                    donation_id = existing[0]
-                    old_amount = existing[1]
-                    old_sub = existing[2]
+        stats = self.save_donations_batch([{'message': message, 'amount': amount, 'last_date': last_date}])
+        if stats['failed']:
+            return (None, None)
 
-                    new_amount = old_amount + amount
+        username = username_key(message)
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            if username:
+                cursor.execute('SELECT id FROM donations WHERE username = ?', (username,))
+            else:
+                cursor.execute('SELECT id FROM donations WHERE message = ?', (message,))
+            row = cursor.fetchone()
 
-                    if old_sub:
-                        new_sub = self._calculate_sub_date(old_sub, amount)
-                    else:
-                        new_sub = self._calculate_sub_date(datetime.now(), amount)
-
-                    cursor.execute('''
-                        UPDATE donations 
-                        SET amount = ?, last_date = ?, sub = ?, updated_at = CURRENT_TIMESTAMP
-                        WHERE message = ?
-                    ''', (new_amount, last_date, new_sub, message))
-                    conn.commit()
-                    logger.info(f"Обновлен донат ID {donation_id}: {message[:50]}... (сумма: {old_amount} -> {new_amount})")
-                    return ('updated', donation_id)
-                else:
-                    sub_date = self._calculate_sub_date(datetime.now(), amount)
-                    
-                    cursor.execute('''
-                        INSERT INTO donations (message, amount, last_date, sub)
-                        VALUES (?, ?, ?, ?)
-                    ''', (message, amount, last_date, sub_date))
-                    conn.commit()
-                    logger.info(f"Добавлен новый донат ID {cursor.lastrowid}: {message[:50]}... (сумма: {amount})")
-                    return ('inserted', cursor.lastrowid)
-                    
-        except sqlite3.Error as e:
-            logger.error(f"Ошибка при сохранении доната '{message[:50]}...': {e}", exc_info=True)
-            return (None, None)
+        status = 'inserted' if stats['inserted'] else 'updated'
+        return (status, row[0] if row else None)
     
-    def save_donations_batch(self, donations):
+    def save_donations_batch(self, donations, update_cursor=False):
         stats = {
             'inserted': 0,
             'updated': 0,
+            'skipped': 0,
             'failed': 0,
             'total': len(donations)
         }
         
         logger.info(f"Начало пакетного сохранения {stats['total']} донатов")
+        started = time.perf_counter()
         
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
+                processed = self._select_processed(cursor, [d.get('id') for d in donations if d.get('id') is not None])
+                groups, last_seen = self._aggregate_donations(donations, processed, stats)
+                chunks_failed = 0
 
-                for donation in donations:
-                    message = donation.get('message', '')
-                    amount = donation.get('amount', 0)
-                    last_date = donation.get('last_date', '')
-                    
-                    if not message:
-                        stats['failed'] += 1
-                        continue
-                    
+                keys = list(groups)
+                for offset in range(0, len(keys), BATCH_CHUNK_SIZE):
+                    chunk = [groups[key] for key in keys[offset:offset + BATCH_CHUNK_SIZE]]
                     try:
-                        cursor.execute(
-                            'SELECT id, amount, sub FROM donations WHERE message = ?',
-                            (message,)
-                        )
-                        existing = cursor.fetchone()
-                        
-                        if existing:
-                            donation_id = existing[0]
-                            old_amount = existing[1]
-                            old_sub = existing[2]
-
-                            new_amount = old_amount + amount
-
-                            if old_sub:
-                                new_sub = self._calculate_sub_date(old_sub, amount)
-                            else:
-                                new_sub = self._calculate_sub_date(datetime.now(), amount)
-
-                            cursor.execute('''
-                                UPDATE donations 
-                                SET amount = ?, last_date = ?, sub = ?, updated_at = CURRENT_TIMESTAMP
-                                WHERE message = ?
-                            ''', (new_amount, last_date, new_sub, message))
-                            stats['updated'] += 1
-                        else:
-                            sub_date = self._calculate_sub_date(datetime.now(), amount)
-                            
-                            cursor.execute('''
-                                INSERT INTO donations (message, amount, last_date, sub)
-                                VALUES (?, ?, ?, ?)
-                            ''', (message, amount, last_date, sub_date))
-                            stats['inserted'] += 1
-
+                        inserted, updated = self._upsert_chunk(cursor, chunk)
+                        conn.commit()
+                        self._publish(cursor, chunk)
+                        stats['inserted'] += inserted
+                        stats['updated'] += updated
                     except sqlite3.Error as e:
-                        logger.error(f"Ошибка при обработке доната '{message[:50]}...': {e}")
-                        stats['failed'] += 1
+                        conn.rollback()
+                        chunks_failed += 1
+                        stats['failed'] += sum(group['count'] for group in chunk)
+                        logger.error(f"Ошибка при сохранении пачки из {len(chunk)} записей: {e}", exc_info=True)
+
+                if update_cursor and last_seen is not None:
+                    if chunks_failed:
+                        logger.warning("Курсор синхронизации не передвинут из-за ошибок сохранения")
+                    else:
+                        self._advance_sync_cursor(cursor, *last_seen)
+                        conn.commit()
                 
-                conn.commit()
-                logger.info(f"Пакетное сохранение завершено: добавлено={stats['inserted']}, обновлено={stats['updated']}, ошибок={stats['failed']}")
+                elapsed = time.perf_counter() - started
+                logger.info(
+                    f"Пакетное сохранение завершено за {elapsed:.2f} с: добавлено={stats['inserted']}, "
+                    f"обновлено={stats['updated']}, пропущено={stats['skipped']}, ошибок={stats['failed']}"
+                )
 
         except sqlite3.Error as e:
             logger.error(f"Критическая ошибка при пакетном сохранении: {e}", exc_info=True)
             stats['failed'] = stats['total']
             stats['inserted'] = 0
             stats['updated'] = 0
+            stats['skipped'] = 0
 
+        BATCH_SECONDS.observe(time.perf_counter() - started)
+        for result in ('inserted', 'updated', 'skipped', 'failed'):
+            if stats[result]:
+                BATCH_ROWS.labels(result).inc(stats[result])
         return stats
+
+    def _select_processed(self, cursor, donation_ids):
+        processed = set()
+        for offset in range(0, len(donation_ids), BATCH_CHUNK_SIZE):
+            chunk = donation_ids[offset:offset + BATCH_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(
+                f'SELECT donation_id FROM processed_donations WHERE donation_id IN ({placeholders})',
+                chunk
+            )
+            processed.update(row[0] for row in cursor.fetchall())
+        return processed
+
+    def _aggregate_donations(self, donations, processed, stats):
+        groups = {}
+        seen_ids = set()
+        last_seen = None
+
+        for donation in donations:
+            external_id = donation.get('id')
+            message = donation.get('message', '')
+            amount = donation.get('amount', 0)
+            last_date = donation.get('last_date') or donation.get('created_at', '')
+
+            if external_id is not None:
+                if last_seen is None or external_id > last_seen[0]:
+                    last_seen = (external_id, donation.get('created_at', ''))
+
+                if external_id in processed or external_id in seen_ids:
+                    stats['skipped'] += 1
+                    continue
+                seen_ids.add(external_id)
+
+            if not message:
+                stats['failed'] += 1
+                continue
+
+            username = username_key(message)
+            key = ('username', username) if username else ('message', message)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'username': username,
+                    'message': message,
+                    'amount': 0,
+                    'last_date': last_date,
+                    'count': 0,
+                    'ids': [],
+                    'donations': []
+                }
+
+            group['amount'] += amount
+            group['donations'].append((donation.get('created_at') or '', amount))
+            group['last_date'] = last_date
+            group['count'] += 1
+            if external_id is not None:
+                group['ids'].append(external_id)
+
+        return groups, last_seen
+
+    def _select_existing(self, cursor, column, values):
+        if not values:
+            return {}
+
+        placeholders = ','.join('?' * len(values))
+        cursor.execute(
+            f'SELECT {column}, sub, expires_at FROM donations WHERE {column} IN ({placeholders})',
+            values
+        )
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    def _upsert_chunk(self, cursor, chunk):
+        existing_by_username = self._select_existing(
+            cursor, 'username', [group['username'] for group in chunk if group['username']]
+        )
+        existing_by_message = self._select_existing(
+            cursor, 'message', [group['message'] for group in chunk if not group['username']]
+        )
+
+        existing = [
+            existing_by_username if group['username'] else existing_by_message
+            for group in chunk
+        ]
+        keys = [group['username'] or group['message'] for group in chunk]
+        # Донаты группы применяются в порядке created_at (сортировка устойчива к равным датам)
+        expiries = calculate_expiries(
+            (rows.get(key, (None, None))[0], [amount for _, amount in sorted(group['donations'], key=lambda d: d[0])])
+            for rows, key, group in zip(existing, keys, chunk)
+        )
+
+        by_username = []
+        by_message = []
+        processed_ids = []
+        summary = StatsDelta(self._stats_watermark(cursor))
+        inserted = 0
+        updated = 0
+
+        for group, rows, key, expiry in zip(chunk, existing, keys, expiries):
+            existed = key in rows
+            new_sub = expiry.isoformat()
+            new_expires_at = int(expiry.timestamp())
+            row = (group['message'], group['username'], group['amount'], group['last_date'], new_sub, new_expires_at)
+            (by_username if group['username'] else by_message).append(row)
+            processed_ids.extend((donation_id,) for donation_id in group['ids'])
+
+            if existed:
+                updated += group['count']
+                summary.change(group['amount'], rows[key][1], new_expires_at)
+            else:
+                inserted += 1
+                updated += group['count'] - 1
+                summary.add(group['amount'], new_expires_at)
+
+        if by_username:
+            cursor.executemany(UPSERT_BY_USERNAME_SQL, by_username)
+        if by_message:
+            cursor.executemany(UPSERT_BY_MESSAGE_SQL, by_message)
+        if processed_ids:
+            cursor.executemany('INSERT INTO processed_donations (donation_id) VALUES (?)', processed_ids)
+
+        summary.apply(cursor)
+
+        return inserted, updated
+
+    def _advance_sync_cursor(self, cursor, last_id, last_created_at):
+        cursor.execute("SELECT value FROM sync_state WHERE key = 'last_donation_id'")
+        row = cursor.fetchone()
+        if row and int(row[0]) >= last_id:
+            return
+
+        cursor.executemany(
+            'INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)',
+            [('last_donation_id', str(last_id)), ('last_created_at', last_created_at or '')]
+        )
+        logger.info(f"Курсор синхронизации передвинут: ID {last_id} ({last_created_at})")
+
+    def get_sync_cursor(self):
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT key, value FROM sync_state')
+            state = dict(cursor.fetchall())
+
+        if 'last_donation_id' not in state:
+            return None
+
+        return {
+            'last_id': int(state['last_donation_id']),
+            'last_created_at': state.get('last_created_at') or None
+        }
     
+    def ping(self):
+        with self._read_connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+        return True
+
     def get_all_donations(self):
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM donations ORDER BY last_date DESC')
             result = cursor.fetchall()
-            logger.debug(f"Получено всех донатов: {len(result)}")
+            logger.debug("Получено всех донатов: %s", len(result))
             return result
     
-    def _escape_like_pattern(self, pattern):
-        escape_chars = ['%', '_', '[', ']']
-        for char in escape_chars:
-            pattern = pattern.replace(char, f'\\{char}')
-        return pattern
-    
+    def get_subscriptions(self):
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT {SUBSCRIPTION_COLUMNS} FROM donations WHERE username IS NOT NULL')
+            return [Subscription(*row) for row in cursor.fetchall()]
+
+    def register_users(self, users):
+        rows = []
+        for username, user_id, last_seen in users:
+            username = normalize_username(username)
+            if username and user_id:
+                rows.append((username, user_id, int(last_seen)))
+
+        if not rows:
+            return 0
+
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                # Пользователь мог сменить username: старая связка удаляется
+                cursor.executemany(
+                    'DELETE FROM telegram_users WHERE user_id = ? AND username != ?',
+                    [(user_id, username) for username, user_id, _ in rows]
+                )
+                cursor.executemany('''
+                    INSERT INTO telegram_users (username, user_id, last_seen)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(username) DO UPDATE SET
+                        user_id = excluded.user_id,
+                        last_seen = MAX(last_seen, excluded.last_seen)
+                ''', rows)
+                conn.commit()
+                logger.debug("Обновлён реестр пользователей Telegram: %s записей", len(rows))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при обновлении реестра пользователей: {e}", exc_info=True)
+            return 0
+
+        usernames = [username for username, _, _ in rows]
+        for listener in self._user_listeners:
+            try:
+                listener(usernames)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике изменений реестра: {e}", exc_info=True)
+        return len(rows)
+
+    def get_user_ids(self, usernames):
+        usernames = list({normalize_username(username) for username in usernames if username})
+        result = {}
+
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            for offset in range(0, len(usernames), BATCH_CHUNK_SIZE):
+                chunk = usernames[offset:offset + BATCH_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(
+                    f'SELECT username, user_id FROM telegram_users WHERE username IN ({placeholders})',
+                    chunk
+                )
+                result.update(cursor.fetchall())
+
+        return result
+
+    def get_active_invite_link(self, user_id):
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT invite_link, expires_at FROM invite_links WHERE user_id = ? AND state = 'active'",
+                (user_id,)
+            )
+            return cursor.fetchone()
+
+    def save_invite_link(self, user_id, invite_link, expires_at):
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "UPDATE invite_links SET state = 'stale' WHERE user_id = ? AND state = 'active'",
+                    (user_id,)
+                )
+                cursor.execute(
+                    'INSERT INTO invite_links (invite_link, user_id, expires_at, created_at) VALUES (?, ?, ?, ?)',
+                    (invite_link, user_id, int(expires_at), int(time.time()))
+                )
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при сохранении ссылки-приглашения для {user_id}: {e}", exc_info=True)
+            return False
+
+    def mark_invite_link_consumed(self, invite_link):
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE invite_links SET state = 'stale' WHERE invite_link = ? AND state = 'active'",
+                (invite_link,)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def get_stale_invite_links(self, limit=100):
+        # Истёкшие ссылки Telegram уже не принимает - отзывать через API нужно только ещё действующие
+        now = int(time.time())
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT invite_link FROM invite_links WHERE state = 'stale' AND expires_at > ? LIMIT ?",
+                (now, limit)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def delete_expired_invite_links(self):
+        now = int(time.time())
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM invite_links WHERE expires_at <= ?', (now,))
+            conn.commit()
+            return cursor.rowcount
+
+    def delete_invite_links(self, invite_links):
+        invite_links = list(invite_links)
+        if not invite_links:
+            return 0
+
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM invite_links WHERE invite_link = ?', [(link,) for link in invite_links])
+            conn.commit()
+            return len(invite_links)
+
     def _validate_username(self, username):
         if not username or not isinstance(username, str):
             return False
@@ -219,18 +695,17 @@ class DonationDB:
             logger.warning(f"Невалидный username: '{username}'")
             return []
         
-        username = username.strip()
-        safe_username = self._escape_like_pattern(username)
+        username = normalize_username(username)
         
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT amount, last_date, sub
+                SELECT amount, last_date, sub, expires_at
                 FROM donations 
-                WHERE message LIKE ? ESCAPE '\\'
-            ''', (f'%{safe_username}%',))
+                WHERE username = ?
+            ''', (username,))
             result = cursor.fetchall()
-            logger.debug(f"Найдено донатов для пользователя '{username}': {len(result)}")
+            logger.debug("Найдено донатов для пользователя '%s': %s", username, len(result))
             return result
     
     def get_user_donations_exact(self, username):
@@ -240,53 +715,481 @@ class DonationDB:
         
         username = username.strip()
         
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT amount, last_date, sub
+                SELECT amount, last_date, sub, expires_at
                 FROM donations 
-                WHERE message = ? OR message LIKE ? ESCAPE '\\'
-            ''', (username, f'%@{self._escape_like_pattern(username)}%'))
+                WHERE username = ? OR message = ?
+                ORDER BY username IS NULL
+                LIMIT 1
+            ''', (normalize_username(username), username))
             result = cursor.fetchall()
-            logger.debug(f"Найдено донатов (точное совпадение) для пользователя '{username}': {len(result)}")
+            logger.debug("Найдено донатов (точное совпадение) для пользователя '%s': %s", username, len(result))
             return result
     
-    def get_expired_subscriptions(self):
-        current_time = datetime.now().isoformat()
-        with self._get_connection() as conn:
+    def get_pending_removals(self, donation_ids=None):
+        now = int(time.time())
+        query = f'''
+            SELECT id, message, sub, username
+            FROM donations
+            WHERE enforcement_state != '{STATE_REMOVED}' AND expires_at < ?
+        '''
+        with self._read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, message, sub
+            if donation_ids is None:
+                cursor.execute(query + ' ORDER BY expires_at', (now,))
+                result = cursor.fetchall()
+            else:
+                donation_ids = list(donation_ids)
+                result = []
+                for offset in range(0, len(donation_ids), BATCH_CHUNK_SIZE):
+                    chunk = donation_ids[offset:offset + BATCH_CHUNK_SIZE]
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(query + f' AND id IN ({placeholders})', [now, *chunk])
+                    result.extend(cursor.fetchall())
+            logger.info(f"Истекших подписок, ожидающих удаления: {len(result)}")
+            return result
+
+    def get_pending_expiries(self):
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, expires_at
+                FROM donations
+                WHERE enforcement_state != '{STATE_REMOVED}' AND expires_at IS NOT NULL
+            ''')
+            return cursor.fetchall()
+
+    def get_reinstated_subscriptions(self):
+        now = int(time.time())
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, message, sub, username
                 FROM donations
-                WHERE sub < ?
-            ''', (current_time,))
+                WHERE enforcement_state = '{STATE_REINSTATED}' AND expires_at >= ?
+                ORDER BY expires_at
+            ''', (now,))
             result = cursor.fetchall()
-            logger.info(f"Найдено истекших подписок: {len(result)}")
+            logger.info(f"Продлённых подписок, ожидающих восстановления: {len(result)}")
             return result
 
+    def set_enforcement_state(self, donation_ids, state):
+        if state not in (STATE_ACTIVE, STATE_REMOVED, STATE_REINSTATED):
+            raise ValueError(f"Неизвестное состояние: {state}")
+
+        donation_ids = list(donation_ids)
+        if not donation_ids:
+            return 0
+
+        now = int(time.time())
+        # Переходы условные: продление могло прийти между выборкой записей и этим обновлением
+        if state == STATE_REMOVED:
+            # Участник уже удалён из канала; если подписку успели продлить, запись уходит
+            # в очередь восстановления, а не помечается удалённой
+            query = f'''
+                UPDATE donations
+                SET enforcement_state = CASE WHEN expires_at < ? THEN '{STATE_REMOVED}' ELSE '{STATE_REINSTATED}' END,
+                    state_changed_at = ?
+                WHERE id = ? AND enforcement_state != '{STATE_REMOVED}'
+            '''
+            params = [(now, now, donation_id) for donation_id in donation_ids]
+        else:
+            source = STATE_REINSTATED if state == STATE_ACTIVE else STATE_REMOVED
+            query = 'UPDATE donations SET enforcement_state = ?, state_changed_at = ? WHERE id = ? AND enforcement_state = ?'
+            params = [(state, now, donation_id, source) for donation_id in donation_ids]
+
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(query, params)
+                changed = cursor.rowcount
+                conn.commit()
+                logger.info(f"Состояние {state} установлено для {changed} из {len(donation_ids)} записей")
+                return changed
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при обновлении состояния удаления: {e}", exc_info=True)
+            return 0
+
+    def count_subscriptions(self):
+        now = int(time.time())
+        with self._read_connection() as conn:
+            cursor = conn.cursor()
+            return self._aggregate_stats(cursor, now)
+
+    def _aggregate_stats(self, cursor, now):
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(amount), 0), COALESCE(SUM(expires_at > ?), 0)
+            FROM donations
+        ''', (now,))
+        total, amount, active = cursor.fetchone()
+        return {'total': total, 'amount': amount, 'active': active, 'expired': total - active}
+
+    def _rebuild_stats_summary(self, cursor):
+        now = int(time.time())
+        stats = self._aggregate_stats(cursor, now)
+        cursor.execute(
+            'INSERT OR REPLACE INTO stats_summary (id, total_users, total_amount, expired_users, counted_until) '
+            'VALUES (1, ?, ?, ?, ?)',
+            (stats['total'], stats['amount'], stats['expired'], now)
+        )
+        cursor.execute('DELETE FROM expiry_histogram')
+        cursor.execute('''
+            INSERT INTO expiry_histogram (day, users)
+            SELECT expires_at / 86400, COUNT(*)
+            FROM donations
+            WHERE expires_at IS NOT NULL
+            GROUP BY expires_at / 86400
+        ''')
+        logger.info(f"Сводная статистика пересчитана: {stats}")
+
+    def _stats_watermark(self, cursor):
+        cursor.execute('SELECT counted_until FROM stats_summary WHERE id = 1')
+        row = cursor.fetchone()
+        if row is None:
+            self._rebuild_stats_summary(cursor)
+            return self._stats_watermark(cursor)
+        return row[0]
+
+    def get_stats_summary(self):
+        now = int(time.time())
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                watermark = self._stats_watermark(cursor)
+
+                # Подписки, истекшие с прошлого подсчёта, переносятся в истекшие по индексу expires_at
+                if now > watermark:
+                    cursor.execute(
+                        'SELECT COUNT(*) FROM donations WHERE expires_at > ? AND expires_at <= ?',
+                        (watermark, now)
+                    )
+                    cursor.execute(
+                        'UPDATE stats_summary SET expired_users = expired_users + ?, counted_until = ? WHERE id = 1',
+                        (cursor.fetchone()[0], now)
+                    )
+
+                cursor.execute('SELECT total_users, total_amount, expired_users FROM stats_summary WHERE id = 1')
+                total, amount, expired = cursor.fetchone()
+
+                today = now // 86400
+                cursor.execute(
+                    'SELECT COUNT(*) FROM donations WHERE expires_at > ? AND expires_at < ?',
+                    (now, (today + 1) * 86400)
+                )
+                expiring_today = cursor.fetchone()[0]
+                cursor.execute('''
+                    SELECT
+                        COALESCE(SUM(CASE WHEN day < ? THEN users END), 0),
+                        COALESCE(SUM(users), 0)
+                    FROM expiry_histogram
+                    WHERE day > ? AND day < ?
+                ''', (today + 7, today, today + 30))
+                expiring_week, expiring_month = (expiring_today + count for count in cursor.fetchone())
+                conn.commit()
+
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка сводной статистики, используется агрегатный запрос: {e}", exc_info=True)
+            stats = self.count_subscriptions()
+            total, amount, expired = stats['total'], stats['amount'], stats['expired']
+            expiring_week = expiring_month = None
+
+        return {
+            'total': total,
+            'amount': amount,
+            'active': total - expired,
+            'expired': expired,
+            'expiring_week': expiring_week,
+            'expiring_month': expiring_month
+        }
+
+
+class StatsDelta:
+    def __init__(self, watermark):
+        self.watermark = watermark
+        self.users = 0
+        self.amount = 0
+        self.expired = 0
+        self.histogram = {}
+
+    def _is_expired(self, expires_at):
+        return expires_at is None or expires_at <= self.watermark
+
+    def _move(self, old_expires_at, new_expires_at):
+        if old_expires_at is not None:
+            day = old_expires_at // 86400
+            self.histogram[day] = self.histogram.get(day, 0) - 1
+        day = new_expires_at // 86400
+        self.histogram[day] = self.histogram.get(day, 0) + 1
+
+    def add(self, amount, expires_at):
+        self.users += 1
+        self.amount += amount
+        self.expired += self._is_expired(expires_at)
+        self._move(None, expires_at)
+
+    def change(self, amount, old_expires_at, new_expires_at):
+        self.amount += amount
+        self.expired += self._is_expired(new_expires_at) - self._is_expired(old_expires_at)
+        self._move(old_expires_at, new_expires_at)
+
+    def apply(self, cursor):
+        cursor.execute(
+            'UPDATE stats_summary SET total_users = total_users + ?, total_amount = total_amount + ?, '
+            'expired_users = expired_users + ? WHERE id = 1',
+            (self.users, self.amount, self.expired)
+        )
+        cursor.executemany(
+            'INSERT INTO expiry_histogram (day, users) VALUES (?, ?) '
+            'ON CONFLICT(day) DO UPDATE SET users = users + excluded.users',
+            [(day, delta) for day, delta in self.histogram.items() if delta]
+        )
+
+
+class AsyncDonationDB:
+    def __init__(self, db=None, readers=None):
+        self._db = db or get_db()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers or SQLiteConnectionManager.READERS,
+            thread_name_prefix='db-reader'
+        )
+        self._lock = threading.Lock()
+        self._queued = {'writer': 0, 'reader': 0}
+        self._running = {'writer': 0, 'reader': 0}
+        self._queries = {}
+
+    async def _run(self, kind, func, *args, **kwargs):
+        executor = self._writer if kind == 'writer' else self._readers
+        name = func.__name__
+        queued_at = time.perf_counter()
+        profiler = get_profiler()
+        section = profiler.current_section()
+        tracer = get_tracer()
+        # Поток пула получает копию контекста вызывающей задачи, вместе с текущим span
+        context = contextvars.copy_context()
+
+        def call():
+            started = time.perf_counter()
+            with self._lock:
+                self._queued[kind] -= 1
+                self._running[kind] += 1
+            if section:
+                profiler.enter_thread(section)
+            try:
+                with tracer.span(f"db.{name}", pool=kind, wait_ms=round((started - queued_at) * 1000, 3)):
+                    return func(*args, **kwargs)
+            finally:
+                if section:
+                    profiler.exit_thread()
+                self._record(kind, name, started - queued_at, time.perf_counter() - started)
+
+        def on_done(future):
+            # Отменённая до старта задача пулом не выполняется, и call() не уменьшит счётчик очереди
+            if future.cancelled():
+                with self._lock:
+                    self._queued[kind] -= 1
+
+        with self._lock:
+            self._queued[kind] += 1
+        future = executor.submit(context.run, call)
+        future.add_done_callback(on_done)
+        return await asyncio.wrap_future(future)
+
+    def _record(self, kind, name, wait, duration):
+        QUERY_SECONDS.labels(kind, name).observe(duration)
+        QUERY_WAIT_SECONDS.labels(kind).observe(wait)
+        with self._lock:
+            self._running[kind] -= 1
+            query = self._queries.get(name)
+            if query is None:
+                query = self._queries[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'wait': 0.0}
+            query['count'] += 1
+            query['total'] += duration
+            query['wait'] += wait
+            if duration > query['max']:
+                query['max'] = duration
+
+        if duration > SLOW_QUERY_SECONDS:
+            logger.warning(f"Медленный запрос к БД {name}: {duration * 1000:.0f} мс (ожидание {wait * 1000:.0f} мс)")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': dict(self._queued),
+                'running': dict(self._running),
+                'queries': {
+                    name: {
+                        'count': q['count'],
+                        'avg_ms': q['total'] / q['count'] * 1000,
+                        'max_ms': q['max'] * 1000,
+                        'avg_wait_ms': q['wait'] / q['count'] * 1000
+                    }
+                    for name, q in self._queries.items()
+                }
+            }
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+    async def save_donation(self, message, amount, last_date):
+        return await self._run('writer', self._db.save_donation, message, amount, last_date)
+
+    async def save_donations_batch(self, donations, update_cursor=False):
+        return await self._run('writer', self._db.save_donations_batch, donations, update_cursor)
+
+    async def get_sync_cursor(self):
+        return await self._run('reader', self._db.get_sync_cursor)
+
+    async def ping(self):
+        return await self._run('reader', self._db.ping)
+
+    async def get_all_donations(self):
+        return await self._run('reader', self._db.get_all_donations)
+
+    async def get_subscriptions(self):
+        return await self._run('reader', self._db.get_subscriptions)
+
+    async def register_users(self, users):
+        return await self._run('writer', self._db.register_users, users)
+
+    async def get_user_ids(self, usernames):
+        return await self._run('reader', self._db.get_user_ids, usernames)
 
-def process_donations(start_date, end_date, ACCESS_TOKEN):
-    logger.info(f"Получение донатов за период: {start_date} - {end_date}")
+    async def get_active_invite_link(self, user_id):
+        return await self._run('reader', self._db.get_active_invite_link, user_id)
+
+    async def save_invite_link(self, user_id, invite_link, expires_at):
+        return await self._run('writer', self._db.save_invite_link, user_id, invite_link, expires_at)
+
+    async def mark_invite_link_consumed(self, invite_link):
+        return await self._run('writer', self._db.mark_invite_link_consumed, invite_link)
+
+    async def get_stale_invite_links(self, limit=100):
+        return await self._run('reader', self._db.get_stale_invite_links, limit)
+
+    async def delete_invite_links(self, invite_links):
+        return await self._run('writer', self._db.delete_invite_links, invite_links)
+
+    async def delete_expired_invite_links(self):
+        return await self._run('writer', self._db.delete_expired_invite_links)
+
+    async def get_user_donations(self, username):
+        return await self._run('reader', self._db.get_user_donations, username)
+
+    async def get_user_donations_exact(self, username):
+        return await self._run('reader', self._db.get_user_donations_exact, username)
+
+    async def get_pending_removals(self, donation_ids=None):
+        return await self._run('reader', self._db.get_pending_removals, donation_ids)
+
+    async def get_pending_expiries(self):
+        return await self._run('reader', self._db.get_pending_expiries)
+
+    async def get_reinstated_subscriptions(self):
+        return await self._run('reader', self._db.get_reinstated_subscriptions)
+
+    async def set_enforcement_state(self, donation_ids, state):
+        return await self._run('writer', self._db.set_enforcement_state, donation_ids, state)
+
+    async def count_subscriptions(self):
+        return await self._run('reader', self._db.count_subscriptions)
+
+    async def get_stats_summary(self):
+        return await self._run('writer', self._db.get_stats_summary)
+
+
+_default_db = None
+_async_db = None
+_subscription_index = SubscriptionIndex()
+
+
+def get_db():
+    global _default_db
+    if _default_db is None:
+        _default_db = DonationDB()
+    return _default_db
+
+
+def get_async_db():
+    global _async_db
+    if _async_db is None:
+        _async_db = AsyncDonationDB()
+    return _async_db
+
+
+def get_subscription_index():
+    return _subscription_index
+
+
+async def load_subscription_index():
+    subscriptions = await get_async_db().get_subscriptions()
+    if not _subscription_index.loaded:
+        get_db().add_listener(_subscription_index.update)
+    _subscription_index.load(subscriptions)
+    return _subscription_index
+
+
+def close_db():
+    global _async_db, _default_db
+    if _async_db is not None:
+        _async_db.close()
+        _async_db = None
+    _default_db = None
+    close_connections()
+
+
+@profiled('process_donations')
+async def process_donations(ACCESS_TOKEN, start_date=None, end_date=None):
+    db = get_async_db()
+    sync_cursor = await db.get_sync_cursor()
+    after_id = None
+
+    if start_date is None and end_date is None:
+        if sync_cursor:
+            after_id = sync_cursor['last_id']
+            logger.info(f"Получение донатов после ID {after_id} ({sync_cursor['last_created_at']})")
+        else:
+            start_date = datetime.now() - INITIAL_SYNC_WINDOW
+            logger.info(f"Курсор синхронизации не найден, получение донатов с {start_date}")
+    else:
+        logger.info(f"Получение донатов за период: {start_date} - {end_date}")
     
-    api = DonationAlertsAPI(ACCESS_TOKEN)
-    donations_data = api.get_all_donations_in_range(start_date, end_date)
+    api = get_api(ACCESS_TOKEN)
+    try:
+        donations_data = await api.get_all_donations_in_range(start_date, end_date, after_id=after_id)
+    except DonationAlertsIncompleteFetchException as e:
+        # Загруженные страницы сохраняются, но курсор остаётся на месте: более старые донаты
+        # между ним и недозагруженной страницей заберёт следующая синхронизация
+        if e.donations:
+            e.donations.sort(key=lambda d: d.get('id') or 0)
+            await db.save_donations_batch(e.donations)
+        raise
     
     if not donations_data:
         logger.info("Донаты не найдены")
         return
     
-    db = DonationDB()
-    stats = db.save_donations_batch(donations_data)
+    donations_data.sort(key=lambda d: d.get('id') or 0)
+    stats = await db.save_donations_batch(donations_data, update_cursor=True)
     
     return stats
 
 
-def user_donations(username):
+async def user_donations(username):
     logger.info(f"Получение донатов пользователя: {username}")
-    db = DonationDB()
-    return db.get_user_donations(username)
 
+    if not _subscription_index.loaded:
+        return await get_async_db().get_user_donations(username)
+
+    if not get_db()._validate_username(username):
+        logger.warning(f"Невалидный username: '{username}'")
+        return []
+
+    subscription = _subscription_index.get(normalize_username(username))
+    if subscription is None:
+        return []
+    return [(subscription.amount, subscription.last_date, subscription.sub, subscription.expires_at)]
 
-def get_expired_users():
-    db = DonationDB()
-    return db.get_expired_subscriptions()
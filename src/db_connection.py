@@ -0,0 +1,127 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class SQLiteConnectionManager:
+    READERS = int(os.getenv('DB_READERS', '4'))
+    STATEMENT_CACHE = 256
+    BUSY_TIMEOUT_MS = 5000
+    CACHE_SIZE_KB = 16384
+    MMAP_SIZE = 128 * 1024 * 1024
+
+    def __init__(self, db_path, readers=None):
+        self.db_path = db_path
+        self._in_memory = db_path == ':memory:'
+        self._max_readers = 0 if self._in_memory else (readers or self.READERS)
+        self._write_lock = threading.RLock()
+        self._readers = queue.LifoQueue()
+        self._readers_lock = threading.Lock()
+        self._readers_created = 0
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._closed = False
+
+        self._writer = self._connect()
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.execute('PRAGMA synchronous=NORMAL')
+        logger.info(f"Открыто соединение SQLite (WAL, читателей до {self._max_readers}): {db_path}")
+
+    def _connect(self, read_only=False):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=self.STATEMENT_CACHE
+        )
+        conn.execute(f'PRAGMA busy_timeout={self.BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA cache_size=-{self.CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={self.MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        if read_only:
+            conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    def ensure_schema(self, init_schema):
+        if self._schema_ready:
+            return
+
+        with self._schema_lock:
+            if not self._schema_ready:
+                init_schema()
+                self._schema_ready = True
+
+    @contextmanager
+    def writer(self):
+        with self._write_lock:
+            try:
+                yield self._writer
+            finally:
+                if self._writer.in_transaction:
+                    logger.warning("Незавершённая транзакция на запись откатывается")
+                    self._writer.rollback()
+
+    @contextmanager
+    def reader(self):
+        if not self._max_readers:
+            with self.writer() as conn:
+                yield conn
+            return
+
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                self._readers.put(conn)
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._readers_lock:
+            if self._readers_created < self._max_readers:
+                self._readers_created += 1
+                return self._connect(read_only=True)
+
+        return self._readers.get()
+
+    def close(self):
+        self._closed = True
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        logger.info(f"Соединения SQLite закрыты: {self.db_path}")
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path):
+    with _managers_lock:
+        manager = _managers.get(db_path)
+        if manager is None:
+            manager = SQLiteConnectionManager(db_path)
+            _managers[db_path] = manager
+        return manager
+
+
+def close_connections():
+    with _managers_lock:
+        for manager in _managers.values():
+            manager.close()
+        _managers.clear()
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import os
+import random
+from typing import Dict, Optional
+
+import aiohttp
+
+from api import DonationAlertsAuthException, get_api
+from db import get_async_db, process_donations
+from health import get_health
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+CENTRIFUGO_URL = os.getenv('DA_CENTRIFUGO_URL', 'wss://centrifugo.donationalerts.com/connection/websocket')
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 60
+HEARTBEAT_SECONDS = 25
+
+
+class DonationStreamError(Exception):
+    pass
+
+
+class DonationStream:
+    def __init__(self, access_token: str, ws_url: Optional[str] = None):
+        self.access_token = access_token
+        self.ws_url = ws_url or CENTRIFUGO_URL
+        self.api = get_api(access_token)
+        self._command_id = 0
+        self.connections = 0
+        self.received = 0
+        self.active = True
+        self._catch_up_task: Optional[asyncio.Task] = None
+
+    def _next_id(self) -> int:
+        self._command_id += 1
+        return self._command_id
+
+    async def _command(self, ws: aiohttp.ClientWebSocketResponse, params: Dict, method: Optional[int] = None) -> Dict:
+        command = {"id": self._next_id(), "params": params}
+        if method is not None:
+            command["method"] = method
+        await ws.send_json(command)
+
+        # До ответа на команду публикаций быть не может: подписка ещё не оформлена
+        while True:
+            for reply in self._decode(await ws.receive()):
+                if reply.get('id') != command['id']:
+                    continue
+                if 'error' in reply:
+                    raise DonationStreamError(f"Centrifugo отклонил команду: {reply['error']}")
+                return reply.get('result', {})
+
+    def _decode(self, message: aiohttp.WSMessage):
+        if message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+            raise DonationStreamError(f"Соединение с Centrifugo закрыто: {message.data!r}")
+        if message.type != aiohttp.WSMsgType.TEXT:
+            return []
+
+        # Centrifugo может прислать несколько JSON-объектов в одном кадре, по одному на строку
+        return [json.loads(line) for line in message.data.splitlines() if line.strip()]
+
+    async def _handle(self, reply: Dict):
+        publication = reply.get('result', {}).get('data', {}).get('data')
+        if not isinstance(publication, dict) or 'id' not in publication:
+            return
+
+        self.received += 1
+        logger.info(f"Донат ID {publication['id']} получен в реальном времени")
+        await get_async_db().save_donations_batch([publication])
+
+    async def _listen(self, session: aiohttp.ClientSession, on_connected=None):
+        user = await self.api.get_user()
+        channel = f"$alerts:donation_{user['id']}"
+
+        async with session.ws_connect(self.ws_url, heartbeat=HEARTBEAT_SECONDS) as ws:
+            connected = await self._command(ws, {"token": user['socket_connection_token']})
+            tokens = await self.api.subscribe_channels([channel], connected['client'])
+            await self._command(ws, {"channel": channel, "token": tokens[channel]}, method=1)
+
+            self.connections += 1
+            logger.info(f"Подписка на донаты в реальном времени оформлена: {channel}")
+            if on_connected is not None:
+                self._catch_up_task = asyncio.create_task(on_connected())
+
+            while True:
+                for reply in self._decode(await ws.receive()):
+                    await self._handle(reply)
+
+    async def _catch_up(self):
+        # Донаты, пришедшие во время разрыва, забираются обычной синхронизацией по курсору
+        try:
+            stats = await process_donations(self.access_token)
+            if stats:
+                logger.info(f"Досинхронизация после переподключения: добавлено {stats['inserted']}, обновлено {stats['updated']}")
+        except Exception as e:
+            logger.error(f"Ошибка досинхронизации после переподключения: {e}", exc_info=True)
+
+    async def run(self):
+        logger.info(f"Получение донатов в реальном времени запущено: {self.ws_url}")
+        delay = RECONNECT_MIN_SECONDS
+
+        async with aiohttp.ClientSession() as session:
+            while True:
+                connections = self.connections
+                on_connected = self._catch_up if connections else None
+                try:
+                    await self._listen(session, on_connected)
+                except asyncio.CancelledError:
+                    raise
+                except DonationAlertsAuthException as e:
+                    # Переподключение не поможет: у токена нет прав oauth-user-show / oauth-donation-subscribe
+                    self.active = False
+                    logger.error(
+                        f"Поток донатов остановлен: DonationAlerts отклонил токен ({e}). "
+                        f"Донаты учитываются ежечасной синхронизацией; выдайте токену нужные права "
+                        f"или выключите DA_STREAMING"
+                    )
+                    task = asyncio.current_task()
+                    if task is not None:
+                        get_health().release(task)
+                    return
+                except Exception as e:
+                    logger.warning(f"Поток донатов прерван: {e!r}")
+
+                # После успешного подключения задержка сбрасывается, при повторных неудачах растёт
+                if self.connections > connections:
+                    delay = RECONNECT_MIN_SECONDS
+                wait = delay * random.uniform(0.5, 1.5)
+                logger.info(f"Переподключение к потоку донатов через {wait:.1f} с")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
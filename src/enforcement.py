@@ -0,0 +1,240 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterable, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+import metrics
+from ratelimit import TokenBucket
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+CONCURRENCY = int(os.getenv('ENFORCEMENT_CONCURRENCY', '8'))
+GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '10'))
+MAX_RETRIES = 3
+
+ACTIONS = metrics.counter('enforcement_actions_total', 'Удаления и разблокировки участников канала', ('action',))
+ERRORS = metrics.counter('enforcement_errors_total', 'Ошибки при удалении и разблокировке', ('kind',))
+RETRY_AFTER = metrics.counter('telegram_retry_after_total', 'Ответы Telegram с flood control (RetryAfter)')
+RUN_SECONDS = metrics.histogram(
+    'enforcement_run_seconds', 'Длительность прохода по списку подписок', ('action',),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+)
+
+_global_limiter: Optional[TokenBucket] = None
+
+
+def get_global_limiter() -> TokenBucket:
+    global _global_limiter
+    if _global_limiter is None:
+        _global_limiter = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+    return _global_limiter
+
+
+_chat_limiters: Dict[str, TokenBucket] = {}
+
+
+def get_chat_limiter(chat_id) -> TokenBucket:
+    # Лимит Telegram действует на чат, а не на экземпляр движка
+    key = str(chat_id)
+    limiter = _chat_limiters.get(key)
+    if limiter is None:
+        limiter = _chat_limiters[key] = TokenBucket(CHAT_RATE, CHAT_RATE)
+    return limiter
+
+
+class FloodControl:
+    # RetryAfter относится ко всему боту: пауза общая для всех движков процесса
+    def __init__(self):
+        self._resume = asyncio.Event()
+        self._resume.set()
+        self._paused_until = 0.0
+
+    async def wait(self):
+        await self._resume.wait()
+
+    async def pause(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        until = loop.time() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self._resume.clear()
+            logger.warning(f"Telegram flood control: все операции приостановлены на {seconds} с")
+
+        while loop.time() < self._paused_until:
+            await asyncio.sleep(self._paused_until - loop.time())
+        self._resume.set()
+
+
+_flood_control: Optional[FloodControl] = None
+
+
+def get_flood_control() -> FloodControl:
+    global _flood_control
+    if _flood_control is None:
+        _flood_control = FloodControl()
+    return _flood_control
+
+
+def _classify_bad_request(error: TelegramBadRequest) -> str:
+    text = str(error).lower()
+    if "user not found" in text or "participant_id_invalid" in text:
+        return 'user_not_found'
+    if "not enough rights" in text:
+        return 'not_enough_rights'
+    return 'bad_request'
+
+
+class EnforcementEngine:
+    def __init__(self, bot: Bot, channel_id: str, concurrency: Optional[int] = None):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.concurrency = max(1, concurrency or CONCURRENCY)
+        self.chat_limiter = get_chat_limiter(channel_id)
+        self.flood_control = get_flood_control()
+        self.report = self._new_report(0)
+
+    def _new_report(self, total: int) -> Dict:
+        return {
+            'total': total,
+            'removed': 0,
+            'reinstated': 0,
+            'settled': [],
+            'unknown_user': [],
+            'errors': Counter(),
+            'retry_after': 0,
+            'elapsed': 0.0,
+            'per_second': 0.0
+        }
+
+    async def call(self, method, *args, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            await self.flood_control.wait()
+            await self.chat_limiter.acquire()
+            await get_global_limiter().acquire()
+
+            try:
+                return await method(*args, **kwargs)
+            except TelegramRetryAfter as e:
+                self.report['retry_after'] += 1
+                RETRY_AFTER.inc()
+                if attempt == MAX_RETRIES:
+                    raise
+                await self.flood_control.pause(e.retry_after)
+
+    def _error(self, kind: str):
+        self.report['errors'][kind] += 1
+        ERRORS.labels(kind).inc()
+
+    async def _enforce(self, row, user_ids):
+        donation_id, message_text, sub_date, username = row
+
+        # Записи без username повторно обрабатывать бесполезно, поэтому они, как и удалённые,
+        # считаются завершёнными
+        if not username:
+            logger.warning(f"Не удалось извлечь username из сообщения: {message_text[:100]}...")
+            self._error('no_username')
+            self.report['settled'].append(donation_id)
+            return
+
+        user_id = user_ids.get(username)
+        if user_id is None:
+            # Запись остаётся в ожидании: удаление повторится, когда пользователь напишет боту
+            logger.warning(f"Пользователь @{username} не найден в реестре Telegram, удаление отложено")
+            self._error('unknown_user_id')
+            self.report['unknown_user'].append((donation_id, username))
+            return
+
+        try:
+            await self.call(self.bot.ban_chat_member, self.channel_id, user_id)
+
+            logger.info(f"Пользователь @{username} удален из канала (подписка до {sub_date})")
+            self.report['removed'] += 1
+            ACTIONS.labels('ban').inc()
+            self.report['settled'].append(donation_id)
+
+        except TelegramBadRequest as e:
+            kind = _classify_bad_request(e)
+            if kind == 'user_not_found':
+                logger.warning(f"Пользователь @{username} не найден в канале")
+                self.report['settled'].append(donation_id)
+            elif kind == 'not_enough_rights':
+                logger.error(f"Недостаточно прав для удаления @{username}")
+            else:
+                logger.error(f"Ошибка при удалении @{username}: {e}")
+            self._error(kind)
+
+        except TelegramForbiddenError as e:
+            logger.error(f"Нет доступа к каналу при удалении @{username}: {e}")
+            self._error('forbidden')
+
+        except TelegramRetryAfter as e:
+            logger.error(f"Flood control не снят после {MAX_RETRIES} попыток для @{username}: {e}")
+            self._error('retry_after')
+
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка при обработке @{username}: {e}", exc_info=True)
+            self._error('unexpected')
+
+    async def _reinstate(self, row, user_ids):
+        donation_id, _, sub_date, username = row
+
+        user_id = user_ids.get(username) if username else None
+        if user_id is None:
+            self.report['settled'].append(donation_id)
+            return
+
+        try:
+            await self.call(self.bot.unban_chat_member, self.channel_id, user_id, only_if_banned=True)
+
+            logger.info(f"Пользователь @{username} разблокирован после продления (подписка до {sub_date})")
+            self.report['reinstated'] += 1
+            ACTIONS.labels('unban').inc()
+            self.report['settled'].append(donation_id)
+
+        except (TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter) as e:
+            logger.error(f"Ошибка при разблокировке @{username}: {e}")
+            self._error('unban')
+
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка при разблокировке @{username}: {e}", exc_info=True)
+            self._error('unexpected')
+
+    async def _worker(self, queue: asyncio.Queue, user_ids: Dict[str, int], reinstate: bool):
+        process = self._reinstate if reinstate else self._enforce
+        while True:
+            row = await queue.get()
+            try:
+                await process(row, user_ids)
+            finally:
+                queue.task_done()
+
+    async def run(self, rows: Iterable, user_ids: Dict[str, int], reinstate: bool = False) -> Dict:
+        rows = list(rows)
+        self.report = self._new_report(len(rows))
+        started = time.perf_counter()
+
+        queue = asyncio.Queue()
+        for row in rows:
+            queue.put_nowait(row)
+
+        workers = [
+            asyncio.create_task(self._worker(queue, user_ids, reinstate))
+            for _ in range(min(self.concurrency, len(rows)))
+        ]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        elapsed = time.perf_counter() - started
+        RUN_SECONDS.labels('unban' if reinstate else 'ban').observe(elapsed)
+        self.report['elapsed'] = elapsed
+        done = self.report['reinstated'] if reinstate else self.report['removed']
+        self.report['per_second'] = done / elapsed if elapsed > 0 else 0.0
+        return self.report
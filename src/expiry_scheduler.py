@@ -0,0 +1,173 @@
+import asyncio
+import heapq
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set
+from aiogram import Bot
+from db import get_async_db, get_db
+from health import get_health
+from subscription_checker import reinstate_renewed_subscriptions, remove_expired_subscriptions
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+BATCH_SIZE = int(os.getenv('EXPIRY_BATCH_SIZE', '20'))
+RETRY_SECONDS = int(os.getenv('EXPIRY_RETRY_SECONDS', '300'))
+MAX_SLEEP_SECONDS = 3600
+
+
+class ExpiryScheduler:
+    def __init__(self, bot: Bot, channel_id: str, batch_size: Optional[int] = None):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.batch_size = max(1, batch_size or BATCH_SIZE)
+        # Куча (expires_at, id) с ленивым удалением: актуальный срок хранится в _armed,
+        # устаревшие элементы кучи пропускаются при извлечении
+        self._heap = []
+        self._armed: Dict[int, int] = {}
+        # Истекшие подписки пользователей, чей Telegram ID ещё неизвестен: username -> id записей
+        self._unknown: Dict[str, Set[int]] = {}
+        self._wakeup = asyncio.Event()
+        self._renewals = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.processed = 0
+
+    def _arm(self, donation_id: int, expires_at: int) -> bool:
+        if self._armed.get(donation_id) == expires_at:
+            return False
+        self._armed[donation_id] = expires_at
+        heapq.heappush(self._heap, (expires_at, donation_id))
+        return True
+
+    def _rearm(self, subscriptions: Iterable):
+        for donation_id, expires_at in subscriptions:
+            if expires_at is not None:
+                self._arm(donation_id, expires_at)
+        # Продление могло вернуть удалённого пользователя, а новый срок — оказаться ближайшим
+        self._renewals = True
+        self._wakeup.set()
+
+    def on_subscriptions_changed(self, subscriptions: List):
+        # Вызывается из потока записи БД после коммита очередного чанка
+        if self._loop is None:
+            return
+        changes = [(subscription.id, subscription.expires_at) for subscription in subscriptions]
+        self._loop.call_soon_threadsafe(self._rearm, changes)
+
+    def on_users_registered(self, usernames: List[str]):
+        # Вызывается из потока записи БД после обновления реестра пользователей
+        if self._loop is None or not self._unknown:
+            return
+        self._loop.call_soon_threadsafe(self._retry_unknown, usernames)
+
+    def _retry_unknown(self, usernames: Iterable[str]):
+        now = int(time.time())
+        armed = False
+        for username in usernames:
+            for donation_id in self._unknown.pop(username, ()):
+                armed = self._arm(donation_id, now) or armed
+        if armed:
+            self._wakeup.set()
+
+    async def load(self):
+        expiries = await get_async_db().get_pending_expiries()
+
+        # Сроки, уже пришедшие от слушателя во время загрузки, свежее прочитанных из БД
+        for donation_id, expires_at in expiries:
+            if donation_id not in self._armed:
+                self._armed[donation_id] = expires_at
+                self._heap.append((expires_at, donation_id))
+        heapq.heapify(self._heap)
+
+        overdue = sum(1 for expires_at, _ in self._heap if expires_at < time.time())
+        logger.info(f"Планировщик истечений загружен: {len(self._heap)} подписок, просрочено за время простоя: {overdue}")
+
+    def _pop_due(self, now: float) -> List[int]:
+        # Сравнение в целых секундах, как в выборке get_pending_removals
+        now = int(now)
+        due = []
+        while self._heap and len(due) < self.batch_size:
+            expires_at, donation_id = self._heap[0]
+            if self._armed.get(donation_id) != expires_at:
+                heapq.heappop(self._heap)
+                continue
+            if expires_at >= now:
+                break
+            heapq.heappop(self._heap)
+            del self._armed[donation_id]
+            due.append(donation_id)
+        return due
+
+    def _next_delay(self, now: float) -> float:
+        while self._heap and self._armed.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return MAX_SLEEP_SECONDS
+        # Подписка считается истекшей строго после expires_at
+        return min(max(self._heap[0][0] + 1 - now, 0), MAX_SLEEP_SECONDS)
+
+    async def _process(self, donation_ids: List[int]):
+        rows = await get_async_db().get_pending_removals(donation_ids)
+        if not rows:
+            return
+
+        report = await remove_expired_subscriptions(self.bot, self.channel_id, rows)
+        self.processed += report['removed']
+
+        # Пользователи без Telegram ID ждут регистрации в реестре, а не повторяются по таймеру
+        for donation_id, username in report['unknown_user']:
+            self._unknown.setdefault(username, set()).add(donation_id)
+
+        # Временные ошибки Telegram: запись остаётся в работе и ставится на повтор
+        settled = set(report['settled'])
+        waiting = {donation_id for donation_id, _ in report['unknown_user']}
+        retry_at = int(time.time()) + RETRY_SECONDS
+        for donation_id, *_ in rows:
+            if donation_id not in settled and donation_id not in waiting and donation_id not in self._armed:
+                self._arm(donation_id, retry_at)
+
+        logger.info(
+            f"Обработана партия истечений: {len(rows)}, удалено: {report['removed']}, "
+            f"на повтор: {len(rows) - len(settled) - len(waiting)}, ждут регистрации: {len(waiting)}"
+        )
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        get_db().add_listener(self.on_subscriptions_changed)
+        get_db().add_user_listener(self.on_users_registered)
+        await self.load()
+        logger.info(f"Планировщик истечений запущен, размер партии: {self.batch_size}")
+        health = get_health()
+        health.expect('expiry', MAX_SLEEP_SECONDS + RETRY_SECONDS)
+        failing = False
+
+        while True:
+            try:
+                if self._renewals:
+                    self._renewals = False
+                    await reinstate_renewed_subscriptions(self.bot, self.channel_id)
+            except Exception as e:
+                logger.error(f"Ошибка при восстановлении продлённых подписок: {e}", exc_info=True)
+
+            due = self._pop_due(time.time())
+            if due:
+                try:
+                    await self._process(due)
+                    failing = False
+                except Exception as e:
+                    failing = True
+                    logger.error(f"Ошибка при обработке партии истечений: {e}", exc_info=True)
+                    retry_at = int(time.time()) + RETRY_SECONDS
+                    for donation_id in due:
+                        if donation_id not in self._armed:
+                            self._arm(donation_id, retry_at)
+                continue
+
+            # Пока партии падают, отметка не обновляется и проверка устаревает
+            if not failing:
+                health.beat('expiry')
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._next_delay(time.time()))
+            except asyncio.TimeoutError:
+                pass
@@ -1,12 +1,16 @@
+import time
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
+from typing import Optional
 
 from decouple import config
 from filters.chat_type import IsPrivateChat
 from scheduler import run_immediate_check, run_immediate_sync
+from middlewares.throttling import ThrottlingMiddleware
+from profiler import get_profiler
 
-from db import DonationDB
+from db import get_async_db, get_subscription_index
 from datetime import datetime
 from logger_config import setup_logger
 
@@ -42,13 +46,14 @@ async def admin_menu(message: Message):
         "/sync - Синхронизировать донаты\n"
         "/check - Проверить подписки\n"
         "/user [username] - Информация о пользователе\n"
+        "/profile [on|off|dump] - Профилировщик event loop\n"
         "/admin - Показать это меню"
     )
     
     await message.answer(text)
 
 @router.message(IsPrivateChat(), F.text == "/stats")
-async def admin_stats(message: Message):
+async def admin_stats(message: Message, throttling: Optional[ThrottlingMiddleware] = None):
     if not is_admin(message.from_user.id):
         logger.warning(f"Попытка доступа к /stats от не-админа: {message.from_user.id}")
         await message.answer("У вас нет прав администратора")
@@ -56,16 +61,14 @@ async def admin_stats(message: Message):
 
     logger.info(f"Админ {message.from_user.id} запросил статистику")
     
-    db = DonationDB()
+    db = get_async_db()
     try:
-        all_donations = db.get_all_donations()
+        summary = await db.get_stats_summary()
         
-        total_donations = len(all_donations)
-        total_amount = sum(d[2] for d in all_donations)
-        
-        current_time = datetime.now().isoformat()
-        active_subs = sum(1 for d in all_donations if d[4] and d[4] > current_time)
-        expired_subs = total_donations - active_subs
+        total_donations = summary['total']
+        total_amount = summary['amount']
+        active_subs = summary['active']
+        expired_subs = summary['expired']
         
         text = (
             "<b>Статистика базы данных</b>\n\n"
@@ -73,16 +76,44 @@ async def admin_stats(message: Message):
             f"Общая сумма донатов: <b>{total_amount:.2f} руб.</b>\n"
             f"Активных подписок: <b>{active_subs}</b>\n"
             f"Истекших подписок: <b>{expired_subs}</b>\n"
-            f"Средний донат: <b>{total_amount/total_donations:.2f} руб.</b>" if total_donations > 0 else ""
         )
+        if total_donations > 0:
+            text += f"Средний донат: <b>{total_amount/total_donations:.2f} руб.</b>\n"
+        if summary['expiring_week'] is not None:
+            text += (
+                f"Истекают в ближайшие 7 дней: <b>{summary['expiring_week']}</b>\n"
+                f"Истекают в ближайшие 30 дней: <b>{summary['expiring_month']}</b>\n"
+            )
+        
+        db_stats = db.stats()
+        text += (
+            "\n<b>Нагрузка на БД</b>\n"
+            f"В очереди: запись <b>{db_stats['queued']['writer']}</b>, чтение <b>{db_stats['queued']['reader']}</b>\n"
+        )
+        for name, query in sorted(db_stats['queries'].items()):
+            text += f"{name}: {query['count']} шт., ср. {query['avg_ms']:.1f} мс, макс. {query['max_ms']:.1f} мс\n"
+
+        index_stats = get_subscription_index().stats()
+        text += (
+            "\n<b>Индекс подписок в памяти</b>\n"
+            f"Записей: <b>{index_stats['entries']}</b>, "
+            f"память: <b>{index_stats['memory_bytes'] / 1024:.0f} КБ</b>\n"
+            f"Попаданий: <b>{index_stats['hits']}</b>, промахов: <b>{index_stats['misses']}</b> "
+            f"({index_stats['hit_ratio']:.0%})\n"
+        )
+        
+        if throttling is not None:
+            text += (
+                "\n<b>Антифлуд</b>\n"
+                f"Пропущено: <b>{throttling.stats['passed']}</b>, задержано: <b>{throttling.stats['delayed']}</b>, "
+                f"отброшено: <b>{throttling.stats['dropped']}</b>, повторов: <b>{throttling.stats['debounced']}</b>\n"
+            )
         
         logger.info(f"Статистика: всего={total_donations}, активных={active_subs}, истекших={expired_subs}")
         await message.answer(text)
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {e}", exc_info=True)
         await message.answer(f"Ошибка при получении статистики: {e}")
-    finally:
-        db.close()
 
 @router.message(IsPrivateChat(), F.text == "/sync")
 async def admin_sync_donations(message: Message):
@@ -104,6 +135,7 @@ async def admin_sync_donations(message: Message):
                 f"Всего обработано: <b>{stats['total']}</b>\n"
                 f"Добавлено новых: <b>{stats['inserted']}</b>\n"
                 f"Обновлено: <b>{stats['updated']}</b>\n"
+                f"Пропущено (уже учтены): <b>{stats['skipped']}</b>\n"
                 f"Ошибок: <b>{stats['failed']}</b>"
             )
             logger.info(f"Синхронизация завершена успешно: {stats}")
@@ -130,9 +162,22 @@ async def admin_check_subscriptions(message: Message):
     await message.answer("Запуск проверки подписок...")
     
     try:
-        await run_immediate_check(message.bot, CHANNEL_ID)
+        report = await run_immediate_check(message.bot, CHANNEL_ID)
         logger.info("Проверка подписок завершена успешно")
-        await message.answer("Проверка подписок завершена")
+        if report:
+            errors = "".join(f"• {kind}: {count}\n" for kind, count in report['errors'].most_common())
+            text = (
+                "<b>Проверка подписок завершена</b>\n\n"
+                f"Проверено: <b>{report['total']}</b>\n"
+                f"Удалено: <b>{report['removed']}</b>\n"
+                f"Flood control: <b>{report['retry_after']}</b>\n"
+                f"Время: <b>{report['elapsed']:.1f} с</b> ({report['per_second']:.1f} удалений/с)\n"
+            )
+            if errors:
+                text += f"\nОшибки:\n{errors}"
+        else:
+            text = "Проверка подписок завершена: истекших подписок нет"
+        await message.answer(text)
     except Exception as e:
         logger.error(f"Ошибка при проверке подписок: {e}", exc_info=True)
         await message.answer(f"Ошибка при проверке: {e}")
@@ -155,7 +200,7 @@ async def admin_user_info(message: Message):
     from db import user_donations
     
     try:
-        stats = user_donations(username)
+        stats = await user_donations(username)
         
         if not stats or len(stats) == 0:
             logger.info(f"Пользователь @{username} не найден в БД")
@@ -166,17 +211,15 @@ async def admin_user_info(message: Message):
         amount = stat[0]
         last_date = stat[1]
         sub_date = stat[2]
+        expires_at = stat[3]
+        now = time.time()
         
-        from datetime import datetime
-        current_time = datetime.now()
-        
-        if sub_date:
-            sub_datetime = datetime.fromisoformat(sub_date.replace('Z', '+00:00'))
-            is_active = sub_datetime > current_time
+        if expires_at is not None:
+            is_active = expires_at > now
             status = "Активна" if is_active else "Истекла"
             
             if is_active:
-                days_left = (sub_datetime - current_time).days
+                days_left = int((expires_at - now) // 86400)
                 status += f" (осталось {days_left} дней)"
         else:
             status = "Не определена"
@@ -193,4 +236,45 @@ async def admin_user_info(message: Message):
         await message.answer(text)
     except Exception as e:
         logger.error(f"Ошибка при получении информации о пользователе @{username}: {e}", exc_info=True)
-        await message.answer(f"Ошибка при получении информации: {e}")
\ No newline at end of file
+        await message.answer(f"Ошибка при получении информации: {e}")
+
+
+@router.message(IsPrivateChat(), Command("profile"))
+async def admin_profile(message: Message):
+    if not is_admin(message.from_user.id):
+        logger.warning(f"Попытка доступа к /profile от не-админа: {message.from_user.id}")
+        await message.answer("У вас нет прав администратора")
+        return
+
+    parts = message.text.split(maxsplit=1)
+    action = parts[1].strip().lower() if len(parts) > 1 else "status"
+    profiler = get_profiler()
+    logger.info(f"Админ {message.from_user.id} выполнил /profile {action}")
+
+    if action == "on":
+        profiler.enable()
+        await message.answer("Профилировщик включён")
+        return
+
+    if action in ("off", "dump"):
+        paths = profiler.disable() if action == "off" else profiler.dump()
+        files = "\n".join(f"• <code>{path.name}</code>" for path in paths) or "нет семплов"
+        title = "Профилировщик выключен" if action == "off" else "Профили сохранены"
+        await message.answer(f"<b>{title}</b>\n\n{files}")
+        return
+
+    if action != "status":
+        await message.answer("Использование: /profile [on|off|dump]")
+        return
+
+    status = profiler.status()
+    samples = "\n".join(f"• {section}: {count}" for section, count in status['samples'].items()) or "нет"
+    slow = "\n".join(
+        f"• {datetime.fromtimestamp(at).strftime('%H:%M:%S')} {duration * 1000:.0f} мс - {origin}"
+        for at, duration, _, origin in status['slow_callbacks'][-5:]
+    ) or "нет"
+    await message.answer(
+        f"<b>Профилировщик:</b> {'включён' if status['enabled'] else 'выключен'}\n\n"
+        f"<b>Семплы:</b>\n{samples}\n\n"
+        f"<b>Медленные callback:</b>\n{slow}"
+    )
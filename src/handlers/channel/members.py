@@ -0,0 +1,22 @@
+from aiogram import Router
+from aiogram.types import ChatMemberUpdated
+
+from invite_links import InviteLinkManager
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+router = Router()
+
+JOINED_STATUSES = {'member', 'restricted'}
+
+
+@router.chat_member()
+async def on_channel_member(event: ChatMemberUpdated, invite_links: InviteLinkManager):
+    if str(event.chat.id) != str(invite_links.channel_id) and f"@{event.chat.username}" != invite_links.channel_id:
+        return
+
+    if event.invite_link is None or event.new_chat_member.status not in JOINED_STATUSES:
+        return
+
+    logger.info(f"Пользователь {event.new_chat_member.user.id} вступил в канал по ссылке-приглашению")
+    await invite_links.mark_consumed(event.invite_link.invite_link)
@@ -1,3 +1,4 @@
+import time
 from aiogram import Router, F
 from aiogram.types import Message
 from datetime import datetime
@@ -6,11 +7,19 @@ from filters.chat_type import IsPrivateChat
 from keyboards.user import get_main_keyboard, get_donate_button
 
 from db import user_donations
+from invite_links import InviteLinkManager
+from tariffs import tariff_lines, tariff_summary
 from logger_config import setup_logger
 
 logger = setup_logger(__name__)
 router = Router()
 
+def activation_hint(donation_stream) -> str:
+    # Без потока донатов DonationAlerts опрашивается раз в час
+    if donation_stream is not None and donation_stream.active:
+        return "обычно донат учитывается в течение минуты, в редких случаях до часа"
+    return "донаты учитываются в течение часа"
+
 def validate_username(username: str) -> bool:
     if not username:
         return False
@@ -18,7 +27,7 @@ def validate_username(username: str) -> bool:
     return bool(re.match(r'^[a-zA-Z0-9_]{5,32}$', username))
 
 @router.message(IsPrivateChat(), F.text == "/start")
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, donation_stream=None):
     user_id = message.from_user.id
     username = message.from_user.username
     
@@ -29,8 +38,8 @@ async def cmd_start(message: Message):
         "Функционал:\n"
         "- Нажмите кнопку 'Приватка' чтобы получить ссылку приглашение, если ваша подписка оплачена.\n"
         "- 'Я' — узнать статус подписки и оставшийся период.\n"
-        "- 'Донат' — приобрести подписку или увеличить срок активной. Каждые 200 рублей продлевают срок подписки на 1 месяц.\n\n"
-        "Если вы оплатили подписку но не можете получить доступ: подождите, списки обновляются каждый час.\n"
+        f"- 'Донат' — приобрести подписку или увеличить срок активной. {tariff_summary()}\n\n"
+        f"Если вы оплатили подписку но не можете получить доступ: подождите, {activation_hint(donation_stream)}.\n"
         "По поводу всех вопросов писать разработчику: @necoweb"
     )
 
@@ -54,8 +63,8 @@ async def cmd_start(message: Message):
     
     await message.answer(text, reply_markup=get_main_keyboard())
 
-@router.message(IsPrivateChat(), F.text == "Приватка")
-async def get_invite_link(message: Message):
+@router.message(IsPrivateChat(), F.text == "Приватка", flags={"throttling": "invite"})
+async def get_invite_link(message: Message, invite_links: InviteLinkManager):
     user_id = message.from_user.id
     username = message.from_user.username
 
@@ -80,7 +89,7 @@ async def get_invite_link(message: Message):
         return
     
     try:
-        donations = user_donations(username)
+        donations = await user_donations(username)
     except Exception as e:
         logger.error(f"Ошибка при получении донатов для @{username}: {e}", exc_info=True)
         text = f"Ошибка при получении данных: {str(e)}\nОбратитесь к администратору @necoweb"
@@ -100,47 +109,36 @@ async def get_invite_link(message: Message):
     donation_data = donations[0]
     amount = donation_data[0]
     last_date = donation_data[1]
-    sub_date_str = donation_data[2]
-
-    try:
-        sub_date = datetime.fromisoformat(sub_date_str.replace('Z', '+00:00'))
-        current_date = datetime.now(sub_date.tzinfo) if sub_date.tzinfo else datetime.now()
+    expires_at = donation_data[3]
 
-        if current_date > sub_date:
-            logger.info(f"Подписка истекла для @{username} ({sub_date})")
-            text = (
-                f"Ваша подписка истекла {sub_date.strftime('%d.%m.%Y')}.\n\n"
-                f"Общая сумма донатов: {amount} руб.\n"
-                f"Последний донат: {last_date}\n\n"
-                "Для продления подписки нажмите кнопку 'Донат'.\n"
-                "Каждые 200 рублей продлевают подписку на 1 месяц."
-            )
-            await message.answer(text, reply_markup=get_main_keyboard())
-            return
-    
-    except (ValueError, AttributeError) as e:
-        logger.error(f"Ошибка парсинга даты для @{username}: {e}", exc_info=True)
+    # Срок подписки посчитан при сохранении доната (expires_at), дату повторно не разбираем
+    if expires_at is None:
+        logger.error(f"Не удалось определить срок подписки для @{username}: {donation_data[2]}")
         text = "Ошибка при проверке даты подписки. Обратитесь к разработчику."
         await message.answer(text, reply_markup=get_main_keyboard())
         return
 
-    try:
-        from decouple import config
-        CHANNEL_ID = config("CHANNEL_ID")
-
-        invite_link = await message.bot.create_chat_invite_link(
-            chat_id=CHANNEL_ID,
-            member_limit=1,
-            name=f'Invite for @{username}'
+    sub_date = datetime.fromtimestamp(expires_at)
+    if time.time() > expires_at:
+        logger.info(f"Подписка истекла для @{username} ({sub_date})")
+        text = (
+            f"Ваша подписка истекла {sub_date.strftime('%d.%m.%Y')}.\n\n"
+            f"Общая сумма донатов: {amount} руб.\n"
+            f"Последний донат: {last_date}\n\n"
+            "Для продления подписки нажмите кнопку 'Донат'.\n"
+            f"{tariff_summary()}"
         )
+        await message.answer(text, reply_markup=get_main_keyboard())
+        return
 
-        logger.info(f"Создана ссылка-приглашение для @{username}")
+    try:
+        invite_link, _ = await invite_links.get_link(user_id, username, sub_date)
         
         text = (
             f"Ваша подписка активна до {sub_date.strftime('%d.%m.%Y')}!\n\n"
             f"Вот ваша персональная ссылка-приглашение в канал:\n"
-            f"{invite_link.invite_link}\n\n"
-            f"Ссылка действительна для одного использования.\n"
+            f"{invite_link}\n\n"
+            f"Ссылка действительна для одного использования до окончания подписки.\n"
             f"После перехода по ссылке она станет недействительной.\n\n"
             f"Общая сумма донатов: {amount} руб."
         )
@@ -179,7 +177,7 @@ async def show_balance(message: Message):
         return
 
     try:
-        donations = user_donations(username)
+        donations = await user_donations(username)
     except Exception as e:
         logger.error(f"Ошибка при получении донатов для @{username}: {e}", exc_info=True)
         text = f"Ошибка при получении данных: {str(e)}"
@@ -198,24 +196,21 @@ async def show_balance(message: Message):
     amount = donation_data[0]
     last_date = donation_data[1]
     sub_date_str = donation_data[2]
+    expires_at = donation_data[3]
+    now = time.time()
 
-    try:
-        sub_date = datetime.fromisoformat(sub_date_str.replace('Z', '+00:00'))
-        current_date = datetime.now(sub_date.tzinfo) if sub_date.tzinfo else datetime.now()
-
-        if current_date > sub_date:
-            status = "Истекла"
-            status_emoji = "🔴"
-        else:
-            days_left = (sub_date - current_date).days
-            status = f"Активна (осталось {days_left} дней)"
-            status_emoji = "🟢"
-
-    except Exception as e:
-        logger.error(f"Ошибка парсинга даты для @{username}: {e}", exc_info=True)
+    if expires_at is None:
+        logger.error(f"Не удалось определить срок подписки для @{username}: {sub_date_str}")
         status = "Ошибка определения статуса"
         status_emoji = "⚠️"
         sub_date_str = "Ошибка определения даты"
+    elif now > expires_at:
+        status = "Истекла"
+        status_emoji = "🔴"
+    else:
+        days_left = int((expires_at - now) // 86400)
+        status = f"Активна (осталось {days_left} дней)"
+        status_emoji = "🟢"
 
     logger.info(f"Статус подписки для @{username}: {status}")
     
@@ -231,7 +226,7 @@ async def show_balance(message: Message):
     await message.answer(text, reply_markup=get_main_keyboard())
 
 @router.message(IsPrivateChat(), F.text == "Донат")
-async def donate_url(message: Message):
+async def donate_url(message: Message, donation_stream=None):
     user_id = message.from_user.id
     username = message.from_user.username
     
@@ -248,14 +243,13 @@ async def donate_url(message: Message):
         await message.answer(text, reply_markup=get_main_keyboard())
         return
     
+    tariffs = "".join(f"• {line}\n" for line in tariff_lines())
     text = (
         f"<b>Оплата подписки</b>\n\n"
         f"ВАЖНО: В сообщении доната обязательно укажите ваш username: @{username}\n\n"
         f"Тарифы:\n"
-        f"• 200 руб = 1 месяц\n"
-        f"• 400 руб = 2 месяца\n"
-        f"• 600 руб = 3 месяца\n\n"
-        f"После оплаты подождите до 1 часа для обновления базы данных.\n\n"
+        f"{tariffs}\n"
+        f"{activation_hint(donation_stream).capitalize()}.\n\n"
         f"Нажмите кнопку ниже для перехода к оплате:"
     )
 
@@ -264,7 +258,7 @@ async def donate_url(message: Message):
 @router.message(IsPrivateChat())
 async def echo_handler(message: Message):
     user_id = message.from_user.id
-    logger.debug(f"Неизвестная команда от пользователя {user_id}: {message.text}")
+    logger.debug("Неизвестная команда от пользователя %s: %s", user_id, message.text)
     
     await message.answer(
         "Неизвестная команда. Используйте кнопки или вручную наберите:\n"
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+from aiohttp import web
+
+import metrics
+from db import get_async_db
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+LAG_INTERVAL_SECONDS = float(os.getenv('HEALTH_LAG_INTERVAL', '1'))
+MAX_LOOP_LAG_SECONDS = float(os.getenv('HEALTH_MAX_LOOP_LAG', '5'))
+POLLING_STALE_SECONDS = int(os.getenv('HEALTH_POLLING_STALE', '120'))
+HEALTH_HOST = os.getenv('HEALTH_HOST', os.getenv('METRICS_HOST', '0.0.0.0'))
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '8081'))
+LAG_WINDOW_SECONDS = 60
+DB_TIMEOUT_SECONDS = 5
+
+LOOP_LAG = metrics.histogram(
+    'event_loop_lag_seconds', 'Задержка срабатывания таймера event loop',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+LAST_SUCCESS = metrics.gauge('job_last_success_seconds', 'Время последнего успешного выполнения (unix time)', ('job',))
+TASK_FAILURES = metrics.counter('background_task_failures_total', 'Неожиданные остановки фоновых задач', ('task',))
+
+
+class HealthMonitor:
+    def __init__(self):
+        self.started = time.time()
+        self.ready = False
+        self.loop_lag = 0.0
+        self._lag_window = deque()
+        self._beats: Dict[str, float] = {}
+        self._max_age: Dict[str, float] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._failed: Dict[str, str] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def expect(self, name: str, max_age: float):
+        # До первого успеха отсчёт идёт от запуска процесса - это и есть запас на старт
+        self._max_age[name] = max_age
+
+    def beat(self, name: str):
+        now = time.time()
+        self._beats[name] = now
+        LAST_SUCCESS.labels(name).set(now)
+
+    def supervise(self, name: str, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        task.add_done_callback(self._on_task_done)
+        self._tasks[name] = task
+        return task
+
+    def release(self, task: asyncio.Task):
+        # Задача завершается намеренно (например, выключенная функция) - это не сбой
+        task.remove_done_callback(self._on_task_done)
+        self._tasks.pop(task.get_name(), None)
+
+    def _on_task_done(self, task: asyncio.Task):
+        if task.cancelled():
+            return
+
+        # Фоновые задачи работают бесконечно, любое завершение - сбой
+        name = task.get_name()
+        error = task.exception()
+        self._failed[name] = repr(error) if error else 'задача завершилась'
+        TASK_FAILURES.labels(name).inc()
+        logger.critical(f"Фоновая задача {name} остановилась: {self._failed[name]}", exc_info=error)
+
+    async def _probe_loop_lag(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(0.0, loop.time() - started - interval)
+            LOOP_LAG.observe(self.loop_lag)
+            self._lag_window.append(self.loop_lag)
+            if self.loop_lag > MAX_LOOP_LAG_SECONDS:
+                logger.warning(f"Event loop был заблокирован на {self.loop_lag:.1f} с")
+
+    def start(self, interval: Optional[float] = None):
+        interval = interval or LAG_INTERVAL_SECONDS
+        # Разовую блокировку видно в проверке ещё минуту, а не только до следующего замера
+        self._lag_window = deque(maxlen=max(1, int(LAG_WINDOW_SECONDS / interval)))
+        self.supervise('loop_lag', self._probe_loop_lag(interval))
+
+    async def on_startup(self):
+        self.ready = True
+
+    async def _check_db(self) -> Dict:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(get_async_db().ping(), DB_TIMEOUT_SECONDS)
+        except Exception as e:
+            return {'ok': False, 'error': repr(e)}
+        return {'ok': True, 'latency_ms': round((time.perf_counter() - started) * 1000, 1)}
+
+    async def check(self) -> Dict:
+        now = time.time()
+        max_lag = max(self._lag_window, default=0.0)
+        checks = {
+            'loop': {
+                'ok': max_lag <= MAX_LOOP_LAG_SECONDS,
+                'lag_seconds': round(self.loop_lag, 3),
+                'max_lag_seconds': round(max_lag, 3)
+            },
+            'db': await self._check_db()
+        }
+
+        for name, max_age in self._max_age.items():
+            last = self._beats.get(name)
+            age = now - (last or self.started)
+            checks[name] = {
+                'ok': age <= max_age,
+                'last_success': int(last) if last else None,
+                'age_seconds': int(age),
+                'max_age_seconds': int(max_age)
+            }
+
+        for name in self._tasks:
+            error = self._failed.get(name)
+            checks[f'task:{name}'] = {'ok': error is None, 'error': error} if error else {'ok': True}
+
+        # Liveness - только то, что лечится перезапуском процесса. БД и свежесть синхронизации
+        # зависят от внешних систем: при их сбое бот снимается с трафика, но не перезапускается
+        live = all(check['ok'] for name, check in checks.items() if self._is_liveness(name))
+        ready = live and self.ready and all(check['ok'] for check in checks.values())
+        return {
+            'status': 'ok' if ready else 'degraded' if live else 'fail',
+            'live': live,
+            'ready': ready,
+            'uptime_seconds': int(now - self.started),
+            'checks': checks
+        }
+
+    @staticmethod
+    def _is_liveness(name: str) -> bool:
+        return name in ('loop', 'polling') or name.startswith('task:')
+
+    async def handle_live(self, request: web.Request) -> web.Response:
+        result = await self.check()
+        return web.json_response(result, status=200 if result['live'] else 503)
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        result = await self.check()
+        return web.json_response(result, status=200 if result['ready'] else 503)
+
+    def setup_routes(self, app: web.Application):
+        app.router.add_get('/health', self.handle_live)
+        app.router.add_get('/health/live', self.handle_live)
+        app.router.add_get('/health/ready', self.handle_ready)
+
+    async def serve(self, host: Optional[str] = None, port: Optional[int] = None):
+        # Отдельный сервер нужен, только если /health не на чем разместить (METRICS_PORT=0)
+        host = host or HEALTH_HOST
+        port = port or HEALTH_PORT
+        app = web.Application()
+        self.setup_routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Проверка состояния доступна на {host}:{port}/health")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class PollingHeartbeat(BaseRequestMiddleware):
+    # getUpdates возвращается не реже раза в polling_timeout, даже если обновлений нет
+    def __init__(self, monitor: HealthMonitor):
+        self.monitor = monitor
+
+    async def __call__(self, make_request, bot: Bot, method):
+        response = await make_request(bot, method)
+        if isinstance(method, GetUpdates):
+            self.monitor.beat('polling')
+        return response
+
+
+_monitor: Optional[HealthMonitor] = None
+
+
+def get_health() -> HealthMonitor:
+    global _monitor
+    if _monitor is None:
+        _monitor = HealthMonitor()
+    return _monitor
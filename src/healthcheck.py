@@ -0,0 +1,58 @@
+"""Проверка состояния бота для Docker healthcheck и оркестраторов.
+
+Запуск:
+    python src/healthcheck.py            - liveness (/health/live)
+    python src/healthcheck.py --ready    - readiness (/health/ready)
+
+Код возврата 0 - бот здоров, 1 - нет ответа или одна из проверок не пройдена.
+Liveness не зависит от БД и DonationAlerts: их сбой снимает готовность, но не вызывает перезапуск.
+Скрипт не импортирует модули бота, чтобы запускаться быстро и без побочных эффектов.
+"""
+import argparse
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+
+def _failed_checks(body: bytes) -> str:
+    try:
+        checks = json.loads(body).get('checks', {})
+    except ValueError:
+        return body.decode('utf-8', 'replace')[:200]
+    return ', '.join(name for name, check in checks.items() if not check.get('ok')) or 'не готов'
+
+
+def probe(url: str, timeout: float) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            body = response.read()
+    except urllib.error.HTTPError as e:
+        print(f"unhealthy ({e.code}): {_failed_checks(e.read())}")
+        return 1
+    except Exception as e:
+        print(f"нет ответа от {url}: {e}")
+        return 1
+
+    print(json.loads(body).get('status', 'ok'))
+    return 0
+
+
+def main() -> int:
+    # При METRICS_PORT=0 бот отдаёт /health на HEALTH_PORT
+    port = os.getenv('METRICS_PORT', '8081')
+    if port == '0':
+        port = os.getenv('HEALTH_PORT', '8081')
+    parser = argparse.ArgumentParser(description="Проверка состояния бота")
+    parser.add_argument('--ready', action='store_true', help="проверять готовность, а не liveness")
+    parser.add_argument('--url', default=os.getenv('HEALTH_URL', f"http://127.0.0.1:{port}"))
+    parser.add_argument('--timeout', type=float, default=5)
+    args = parser.parse_args()
+
+    path = '/health/ready' if args.ready else '/health/live'
+    return probe(args.url.rstrip('/') + path, args.timeout)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from db import get_async_db
+from enforcement import EnforcementEngine
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+REVOKE_BATCH_SIZE = int(os.getenv('INVITE_REVOKE_BATCH_SIZE', '50'))
+REVOKE_INTERVAL_SECONDS = int(os.getenv('INVITE_REVOKE_INTERVAL', '600'))
+
+
+class InviteLinkManager:
+    def __init__(self, bot: Bot, channel_id: str):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.engine = EnforcementEngine(bot, channel_id)
+        # user_id -> [блокировка, число ожидающих]; запись удаляется, когда последний из них завершился
+        self._locks: Dict[int, list] = {}
+        self.stats = {'created': 0, 'reused': 0, 'consumed': 0, 'revoked': 0, 'expired': 0}
+
+    async def get_link(self, user_id: int, username: str, expires_at: datetime) -> Tuple[str, bool]:
+        # Повторные нажатия одного пользователя не должны создавать несколько ссылок параллельно
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._get_link(user_id, username, expires_at)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[user_id]
+
+    async def _get_link(self, user_id: int, username: str, expires_at: datetime) -> Tuple[str, bool]:
+        expires_ts = int(expires_at.timestamp())
+        db = get_async_db()
+
+        cached = await db.get_active_invite_link(user_id)
+        if cached is not None:
+            invite_link, cached_expires = cached
+            # Ссылка выдаётся до конца подписки; после продления нужна новая с новым сроком
+            if cached_expires == expires_ts and cached_expires > time.time():
+                self.stats['reused'] += 1
+                logger.info(f"Повторно выдана ссылка-приглашение для @{username}")
+                return invite_link, True
+
+        link = await self.engine.call(
+            self.bot.create_chat_invite_link,
+            chat_id=self.channel_id,
+            member_limit=1,
+            expire_date=expires_ts,
+            name=f'Invite for @{username}'[:32]
+        )
+        await db.save_invite_link(user_id, link.invite_link, expires_ts)
+        self.stats['created'] += 1
+        logger.info(f"Создана ссылка-приглашение для @{username} до {expires_at.strftime('%d.%m.%Y')}")
+        return link.invite_link, False
+
+    async def mark_consumed(self, invite_link: str) -> bool:
+        consumed = await get_async_db().mark_invite_link_consumed(invite_link)
+        if consumed:
+            self.stats['consumed'] += 1
+            logger.info("Ссылка-приглашение использована и поставлена на отзыв")
+        return consumed
+
+    async def _revoke(self, invite_link: str) -> bool:
+        try:
+            await self.engine.call(self.bot.revoke_chat_invite_link, self.channel_id, invite_link)
+            return True
+        except TelegramBadRequest as e:
+            # Ссылка уже истекла или удалена в Telegram - хранить её больше незачем
+            logger.debug("Ссылка-приглашение уже недействительна: %s", e)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка отзыва ссылки-приглашения: {e}")
+            return False
+
+    async def revoke_stale(self) -> int:
+        db = get_async_db()
+        revoked = 0
+
+        expired = await db.delete_expired_invite_links()
+        if expired:
+            self.stats['expired'] += expired
+            logger.info(f"Удалено истёкших ссылок-приглашений: {expired}")
+
+        while True:
+            links = await db.get_stale_invite_links(REVOKE_BATCH_SIZE)
+            if not links:
+                break
+
+            results = await asyncio.gather(*(self._revoke(link) for link in links))
+            done = [link for link, ok in zip(links, results) if ok]
+            await db.delete_invite_links(done)
+            revoked += len(done)
+
+            if len(done) < len(links):
+                logger.warning(f"Не удалось отозвать ссылок: {len(links) - len(done)}, повтор в следующий раз")
+                break
+
+        if revoked:
+            self.stats['revoked'] += revoked
+            logger.info(f"Отозвано ссылок-приглашений: {revoked}")
+        return revoked
+
+    async def run(self, interval: Optional[int] = None):
+        interval = interval or REVOKE_INTERVAL_SECONDS
+        logger.info(f"Отзыв устаревших ссылок-приглашений каждые {interval} с")
+
+        while True:
+            try:
+                await self.revoke_stale()
+            except Exception as e:
+                logger.error(f"Ошибка при отзыве ссылок-приглашений: {e}", exc_info=True)
+            await asyncio.sleep(interval)
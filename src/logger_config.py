@@ -1,46 +1,175 @@
+import atexit
 import logging
-import sys
+import logging.handlers
 import os
+import queue
+import random
+import sys
+import threading
+from datetime import date, timedelta
 from pathlib import Path
-from datetime import datetime
 
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '14'))
+PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0'))
+PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000'))
+
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+
+
+class DailyRotatingFileHandler(logging.FileHandler):
+    """Файл prefix_YYYY-MM-DD.log, который переключается в полночь и при превышении max_bytes
+    продолжается в prefix_YYYY-MM-DD.1.log, .2.log и т.д. Файлы старше retention_days удаляются."""
+
+    def __init__(
+        self,
+        log_dir: Path,
+        prefix: str,
+        max_bytes: int = MAX_BYTES,
+        retention_days: int = RETENTION_DAYS,
+        suffix: str = '.log'
+    ):
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.day = date.today()
+        self.part = self._last_part(self.day)
+        super().__init__(self._path(self.day, self.part), encoding='utf-8', delay=True)
+
+    def _path(self, day: date, part: int) -> Path:
+        part_suffix = f".{part}" if part else ""
+        return self.log_dir / f"{self.prefix}_{day.isoformat()}{part_suffix}{self.suffix}"
+
+    def _last_part(self, day: date) -> int:
+        part = 0
+        while self._path(day, part + 1).exists():
+            part += 1
+        return part
+
+    def _should_rotate(self, today: date) -> bool:
+        if today != self.day:
+            return True
+        if self.max_bytes and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def _rotate(self, today: date):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        if today != self.day:
+            self.day = today
+            self.part = 0
+            self._cleanup()
+        else:
+            self.part += 1
+        self.baseFilename = os.path.abspath(self._path(self.day, self.part))
+
+    def _cleanup(self):
+        if not self.retention_days:
+            return
+        oldest = (self.day - timedelta(days=self.retention_days)).isoformat()
+        for path in self.log_dir.glob(f"{self.prefix}_*{self.suffix}"):
+            day = path.name[len(self.prefix) + 1:len(self.prefix) + 11]
+            if day < oldest:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def emit(self, record: logging.LogRecord):
+        today = date.today()
+        if self._should_rotate(today):
+            self._rotate(today)
+        super().emit(record)
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Очередь внутри процесса: форматирование строки и traceback выполняет поток слушателя,
+        # в вызывающем коде остаётся только подстановка аргументов
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _start_pipeline() -> logging.Handler:
+    global _queue_handler, _listener
 
-def setup_logger(name: str = __name__, log_level: str = "INFO") -> logging.Logger:
     log_dir = Path(os.getenv('LOG_DIR', '/app/logs'))
     log_dir.mkdir(exist_ok=True)
-    
-    logger = logging.getLogger(name)
-    logger.setLevel(getattr(logging, log_level.upper(), logging.INFO))
-    
-    if logger.handlers:
-        return logger
-    
-    formatter = logging.Formatter(
-        fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
-    
-    file_handler = logging.FileHandler(
-        filename=log_dir / f"bot_{datetime.now().strftime('%Y-%m-%d')}.log",
-        encoding='utf-8'
-    )
+
+    formatter = logging.Formatter(fmt=LOG_FORMAT, datefmt=DATE_FORMAT)
+
+    file_handler = DailyRotatingFileHandler(log_dir, 'bot')
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
-    
-    error_handler = logging.FileHandler(
-        filename=log_dir / f"errors_{datetime.now().strftime('%Y-%m-%d')}.log",
-        encoding='utf-8'
-    )
+
+    error_handler = DailyRotatingFileHandler(log_dir, 'errors')
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(formatter)
-    
+
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    
-    logger.addHandler(file_handler)
-    logger.addHandler(error_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
\ No newline at end of file
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = _InProcessQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(
+        log_queue, file_handler, error_handler, console_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _queue_handler
+
+
+def shutdown_logging():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+def setup_logger(name: str = __name__, log_level: str = "INFO") -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(getattr(logging, log_level.upper(), logging.INFO))
+
+    if logger.handlers:
+        return logger
+
+    with _lock:
+        handler = _queue_handler or _start_pipeline()
+    logger.addHandler(handler)
+
+    return logger
+
+
+def add_record_filter(record_filter: logging.Filter):
+    # Фильтр выполняется в вызывающем потоке до постановки записи в очередь,
+    # поэтому видит переменные контекста (например, текущий trace)
+    with _lock:
+        handler = _queue_handler or _start_pipeline()
+    handler.addFilter(record_filter)
+
+
+def log_payload(logger: logging.Logger, label: str, payload, level: int = logging.DEBUG):
+    # Крупные тела ответов пишутся только для доли запросов и с обрезкой
+    if PAYLOAD_SAMPLE_RATE <= 0 or not logger.isEnabledFor(level):
+        return
+    if PAYLOAD_SAMPLE_RATE < 1 and random.random() >= PAYLOAD_SAMPLE_RATE:
+        return
+
+    text = payload if isinstance(payload, str) else repr(payload)
+    if len(text) > PAYLOAD_MAX_CHARS:
+        text = f"{text[:PAYLOAD_MAX_CHARS]}... ({len(text)} символов)"
+    logger.log(level, "%s: %s", label, text)
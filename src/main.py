@@ -9,9 +9,25 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from filters.chat_type import IsPrivateChat  
+from middlewares.user_registry import UserRegistryMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from middlewares.metrics import HandlerMetricsMiddleware
+from middlewares.profiler import ProfilerMiddleware
+from middlewares.tracing import TracingMiddleware
 from handlers.user.message import router as user_router
 from handlers.admin.commands import router as admin_router
+from handlers.channel.members import router as channel_router
 from scheduler import schedule_daily_check, schedule_hourly_donations_sync
+from expiry_scheduler import ExpiryScheduler
+from donation_stream import DonationStream
+from webhook import run_webhook
+from invite_links import InviteLinkManager
+from metrics import MetricsServer
+from health import POLLING_STALE_SECONDS, PollingHeartbeat, get_health
+from profiler import PROFILE_ENABLED, get_profiler
+from tracing import TelegramTracingMiddleware, get_tracer
+from api import close_api_clients
+from db import close_db, load_subscription_index
 from logger_config import setup_logger
 
 logger = setup_logger(__name__)
@@ -34,29 +50,100 @@ async def main():
 
     dp.include_router(user_router)
     dp.include_router(admin_router)
+    dp.include_router(channel_router)
 
     dp.message.filter(IsPrivateChat())
 
+    tracer = get_tracer()
+    tracer.start()
+    tracing = TracingMiddleware(tracer)
+    dp.update.outer_middleware(tracing)
+    bot.session.middleware(TelegramTracingMiddleware(tracer))
+
+    dp.update.outer_middleware(UserRegistryMiddleware())
+
+    throttling = ThrottlingMiddleware()
+    dp.message.middleware(throttling)
+    dp["throttling"] = throttling
+
+    handler_metrics = HandlerMetricsMiddleware()
+    handler_profiler = ProfilerMiddleware()
+    for observer in (dp.message, dp.chat_member):
+        observer.middleware(handler_metrics)
+        observer.middleware(handler_profiler)
+        observer.middleware(tracing)
+
     CHANNEL_ID = config("CHANNEL_ID")
     ACCESS_TOKEN = config("ACCESS_TOKEN")
 
+    BOT_MODE = config("BOT_MODE", default="polling").lower()
+    DA_STREAMING = config("DA_STREAMING", default="false").lower() in ("1", "true", "yes")
+    METRICS_PORT = int(config("METRICS_PORT", default="8081"))
+
     CHECK_HOUR = int(config("CHECK_HOUR", default="12"))
     CHECK_MINUTE = int(config("CHECK_MINUTE", default="0"))
     check_time = time(CHECK_HOUR, CHECK_MINUTE)
 
-    logger.info(f"Настройки: CHANNEL_ID={CHANNEL_ID}, CHECK_TIME={check_time}")
+    logger.info(f"Настройки: CHANNEL_ID={CHANNEL_ID}, CHECK_TIME={check_time}, DA_STREAMING={DA_STREAMING}, BOT_MODE={BOT_MODE}")
+
+    await load_subscription_index()
+
+    if PROFILE_ENABLED:
+        get_profiler().enable()
+
+    health = get_health()
+    health.start()
+    dp.startup.register(health.on_startup)
+
+    # /health отдаётся тем же HTTP-сервером, что и /metrics; без метрик - отдельным сервером на HEALTH_PORT,
+    # иначе healthcheck в docker-compose.yml остался бы без ответа
+    metrics_server = MetricsServer()
+    health.setup_routes(metrics_server.app)
+    if METRICS_PORT:
+        await metrics_server.start(port=METRICS_PORT)
+    else:
+        await health.serve()
 
-    asyncio.create_task(schedule_daily_check(bot, CHANNEL_ID, check_time))
-    asyncio.create_task(schedule_hourly_donations_sync(ACCESS_TOKEN))
+    invite_links = InviteLinkManager(bot, CHANNEL_ID)
+    dp["invite_links"] = invite_links
 
-    logger.info("Фоновые задачи запущены, начало polling...")
+    health.supervise('expiry', ExpiryScheduler(bot, CHANNEL_ID).run())
+    health.supervise('daily_check', schedule_daily_check(bot, CHANNEL_ID, check_time))
+    health.supervise('sync', schedule_hourly_donations_sync(ACCESS_TOKEN))
+    health.supervise('invite_links', invite_links.run())
+    # Обработчики выбирают текст о сроке учёта доната по тому, работает ли поток
+    donation_stream = DonationStream(ACCESS_TOKEN) if DA_STREAMING else None
+    dp["donation_stream"] = donation_stream
+    if donation_stream is not None:
+        health.supervise('donation_stream', donation_stream.run())
 
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            logger.info("Фоновые задачи запущены, запуск webhook...")
+            await run_webhook(
+                dp,
+                bot,
+                url=config("WEBHOOK_URL"),
+                secret=config("WEBHOOK_SECRET"),
+                host=config("WEBHOOK_HOST", default="0.0.0.0"),
+                port=int(config("WEBHOOK_PORT", default="8080")),
+                path=config("WEBHOOK_PATH", default="/webhook")
+            )
+        else:
+            logger.info("Фоновые задачи запущены, начало polling...")
+            health.expect('polling', POLLING_STALE_SECONDS)
+            bot.session.middleware(PollingHeartbeat(health))
+            await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Критическая ошибка при работе бота: {e}", exc_info=True)
         raise
     finally:
+        get_profiler().disable()
+        tracer.stop()
+        await metrics_server.stop()
+        await health.stop()
+        await close_api_clients()
+        close_db()
         await bot.session.close()
         logger.info("Бот остановлен, сессия закрыта")
 
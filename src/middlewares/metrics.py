@@ -0,0 +1,30 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import metrics
+
+HANDLER_SECONDS = metrics.histogram('handler_seconds', 'Время работы обработчика aiogram', ('handler',))
+HANDLER_ERRORS = metrics.counter('handler_errors_total', 'Исключения в обработчиках aiogram', ('handler',))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        # Внутренний middleware вызывается уже после выбора обработчика, поэтому его имя известно
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object is not None else 'unknown'
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(name).observe(time.perf_counter() - started)
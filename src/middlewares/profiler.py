@@ -0,0 +1,31 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from profiler import Profiler, get_profiler
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    def __init__(self, profiler: Optional[Profiler] = None):
+        self.profiler = profiler or get_profiler()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not self.profiler.enabled:
+            return await handler(event, data)
+
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object is not None else 'unknown'
+        update = data.get('event_update')
+        user = data.get('event_from_user')
+        origin = (
+            f"обработчик {name}, update {update.update_id if update else '-'}, "
+            f"пользователь {user.id if user else '-'}"
+        )
+
+        with self.profiler.origin(origin), self.profiler.section(f"handler.{name}"):
+            return await handler(event, data)
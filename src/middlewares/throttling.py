@@ -0,0 +1,124 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+
+        name, value = item.split('=')
+        rate, burst = value.split('/')
+        rate, burst = float(rate), float(burst)
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Некорректный лимит: {item}")
+        limits[name.strip()] = (rate, burst)
+
+    limits.setdefault('default', (1.0, 3.0))
+    return limits
+
+
+LIMITS = parse_limits(os.getenv('THROTTLE_LIMITS', 'default=1/3,invite=0.2/2'))
+DEBOUNCE_SECONDS = float(os.getenv('THROTTLE_DEBOUNCE_SECONDS', '2'))
+MAX_DELAY_SECONDS = float(os.getenv('THROTTLE_MAX_DELAY_SECONDS', '0.5'))
+TTL_SECONDS = 600
+REPLY = os.getenv('THROTTLE_REPLY', 'true').lower() in ('1', 'true', 'yes')
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'text_hash', 'text_at', 'warned')
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.text_hash = 0
+        self.text_at = 0.0
+        self.warned = False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None, reply: Optional[bool] = None):
+        self.limits = limits or LIMITS
+        self.reply = REPLY if reply is None else reply
+        # Порядок вставки = порядок последнего обращения, поэтому просроченные записи всегда в начале
+        self._buckets: 'OrderedDict[Tuple[int, str], _Bucket]' = OrderedDict()
+        self.stats = Counter()
+
+    def _evict(self, now: float):
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated < TTL_SECONDS:
+                break
+            del self._buckets[key]
+            self.stats['evicted'] += 1
+
+    def _bucket(self, key: Tuple[int, str], burst: float, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(burst, now)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        limit_name = get_flag(data, 'throttling', default='default')
+        user = data.get('event_from_user')
+        if user is None or limit_name is False:
+            return await handler(event, data)
+
+        rate, burst = self.limits.get(limit_name, self.limits['default'])
+        now = time.monotonic()
+        self._evict(now)
+        bucket = self._bucket((user.id, limit_name), burst, now)
+
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+
+        text = getattr(event, 'text', None)
+        if text:
+            text_hash = hash(text)
+            if text_hash == bucket.text_hash and now - bucket.text_at < DEBOUNCE_SECONDS:
+                bucket.text_at = now
+                self.stats['debounced'] += 1
+                return None
+            bucket.text_hash = text_hash
+            bucket.text_at = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.warned = False
+            self.stats['passed'] += 1
+            return await handler(event, data)
+
+        wait = (1 - bucket.tokens) / rate
+        if wait <= MAX_DELAY_SECONDS:
+            # Небольшое превышение сглаживается задержкой, токен резервируется сразу
+            bucket.tokens -= 1
+            self.stats['delayed'] += 1
+            await asyncio.sleep(wait)
+            return await handler(event, data)
+
+        self.stats['dropped'] += 1
+        if self.reply and not bucket.warned and isinstance(event, Message):
+            bucket.warned = True
+            await event.answer(f"Слишком часто. Повторите через {math.ceil(wait)} с.")
+        logger.debug("Обновление от %s отброшено ограничителем '%s', ожидание %.1f с", user.id, limit_name, wait)
+        return None
@@ -0,0 +1,39 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from tracing import Tracer, get_tracer
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Внешний middleware на Update открывает корневой span обновления,
+    внутренний на message/chat_member - дочерний span выбранного обработчика."""
+
+    def __init__(self, tracer: Optional[Tracer] = None):
+        self.tracer = tracer or get_tracer()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not self.tracer.enabled:
+            return await handler(event, data)
+
+        if isinstance(event, Update):
+            user = data.get('event_from_user')
+            with self.tracer.trace(
+                f"update.{event.event_type}",
+                update_id=event.update_id,
+                user_id=user.id if user else None
+            ):
+                return await handler(event, data)
+
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object is not None else 'unknown'
+        root = self.tracer.current_span()
+        if root is not None:
+            root.set(handler=name)
+        with self.tracer.span(f"handler.{name}"):
+            return await handler(event, data)
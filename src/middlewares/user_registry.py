@@ -0,0 +1,71 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from db import get_async_db
+from usernames import normalize_username
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class UserRegistryMiddleware(BaseMiddleware):
+    REFRESH_SECONDS = 3600
+    FLUSH_SECONDS = 1.0
+
+    def __init__(self):
+        # Порядок вставки = порядок последней записи в реестр, поэтому устаревшие записи всегда в начале
+        self._seen: 'OrderedDict[int, tuple]' = OrderedDict()
+        self._pending: Dict[int, tuple] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _evict(self, now: float):
+        while self._seen:
+            user_id, (_, registered) = next(iter(self._seen.items()))
+            if now - registered <= self.REFRESH_SECONDS:
+                break
+            del self._seen[user_id]
+
+    def _schedule(self, user_id: int, username: str, now: float):
+        self._pending[user_id] = (username, user_id, now)
+        if self._flush_task is None:
+            # Пустой контекст: запись не относится к обновлению, которое её вызвало (трассировка)
+            self._flush_task = asyncio.create_task(self._flush(), context=contextvars.Context())
+
+    async def _flush(self):
+        # Обновления не ждут очереди потока записи БД: связки копятся и пишутся одной пачкой
+        await asyncio.sleep(self.FLUSH_SECONDS)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        try:
+            await get_async_db().register_users(list(pending.values()))
+        except Exception as e:
+            logger.error(f"Ошибка регистрации {len(pending)} пользователей: {e}", exc_info=True)
+            # Без отметки о записи связки будут записаны повторно при следующем обновлении
+            for user_id in pending:
+                self._seen.pop(user_id, None)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        username = normalize_username(user.username) if user else None
+
+        if username:
+            now = time.time()
+            self._evict(now)
+            seen = self._seen.get(user.id)
+            # В БД пишем только новую связку или раз в REFRESH_SECONDS
+            if seen is None or seen[0] != username or now - seen[1] > self.REFRESH_SECONDS:
+                self._seen[user.id] = (username, now)
+                self._seen.move_to_end(user.id)
+                self._schedule(user.id, username, now)
+
+        return await handler(event, data)
@@ -0,0 +1,233 @@
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import metrics
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+PROFILE_ENABLED = os.getenv('PROFILE', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', os.path.join(os.getenv('LOG_DIR', '/app/logs'), 'profiles')))
+SLOW_CALLBACK_SECONDS = float(os.getenv('PROFILE_SLOW_CALLBACK_MS', '100')) / 1000
+SAMPLE_INTERVAL_SECONDS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '10')) / 1000
+MAX_STACK_DEPTH = 128
+
+SLOW_CALLBACKS = metrics.counter('slow_callbacks_total', 'Callback event loop дольше порога профилировщика')
+
+# Имя профилируемого участка и описание обновления; наследуются дочерними задачами
+_section: ContextVar[Optional[str]] = ContextVar('profile_section', default=None)
+_origin: ContextVar[Optional[str]] = ContextVar('profile_origin', default=None)
+
+_original_handle_run = asyncio.events.Handle._run
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame, root: str) -> str:
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    return ';'.join(reversed(labels))
+
+
+def _describe_callback(handle) -> str:
+    callback = handle._callback
+    task = getattr(callback, '__self__', None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return f"задача {task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+    return getattr(callback, '__qualname__', repr(callback))
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.slow_callbacks = deque(maxlen=20)
+        self._samples: Dict[str, Counter] = {}
+        self._loop_thread: Optional[int] = None
+        # Контекст callback, который выполняется в event loop прямо сейчас (читается потоком семплера)
+        self._running_context = None
+        # Источник, заданный в текущем шаге: обработчик может начаться и закончиться в одном callback,
+        # и к моменту замера переменная контекста уже сброшена
+        self._step_origin: Optional[str] = None
+        self._thread_sections: Dict[int, str] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        if self.enabled:
+            return
+
+        self._loop_thread = threading.get_ident()
+        profiler = self
+
+        # Подмена Handle._run действует только пока профилировщик включён;
+        # в выключенном состоянии event loop работает с исходным методом без накладных расходов
+        def timed_run(handle):
+            profiler._running_context = handle._context
+            profiler._step_origin = None
+            started = time.perf_counter()
+            try:
+                _original_handle_run(handle)
+            finally:
+                profiler._running_context = None
+                duration = time.perf_counter() - started
+                if duration > SLOW_CALLBACK_SECONDS:
+                    profiler._report_slow(handle, duration)
+
+        asyncio.events.Handle._run = timed_run
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+        self._sampler.start()
+        self.enabled = True
+        logger.info(
+            f"Профилировщик включён: медленные callback > {SLOW_CALLBACK_SECONDS * 1000:.0f} мс, "
+            f"семплирование каждые {SAMPLE_INTERVAL_SECONDS * 1000:.0f} мс, профили в {PROFILE_DIR}"
+        )
+
+    def disable(self) -> List[Path]:
+        if not self.enabled:
+            return []
+
+        asyncio.events.Handle._run = _original_handle_run
+        self.enabled = False
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+        self._running_context = None
+        logger.info("Профилировщик выключен")
+        return self.dump()
+
+    def _report_slow(self, handle, duration: float):
+        context = handle._context
+        origin = context.get(_origin) or self._step_origin or context.get(_section) or '-'
+        description = _describe_callback(handle)
+        self.slow_callbacks.append((time.time(), duration, description, origin))
+        SLOW_CALLBACKS.inc()
+        logger.warning(f"Медленный callback event loop: {duration * 1000:.0f} мс, {description}, источник: {origin}")
+
+    @contextmanager
+    def section(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        token = _section.set(name)
+        if self._step_origin is None:
+            self._step_origin = name
+        try:
+            yield
+        finally:
+            _section.reset(token)
+
+    @contextmanager
+    def origin(self, description: str):
+        if not self.enabled:
+            yield
+            return
+
+        token = _origin.set(description)
+        self._step_origin = description
+        try:
+            yield
+        finally:
+            _origin.reset(token)
+
+    def current_section(self) -> Optional[str]:
+        return _section.get()
+
+    def enter_thread(self, section: str):
+        # Работа в пуле потоков БД относится к участку, из которого её отправили
+        self._thread_sections[threading.get_ident()] = section
+
+    def exit_thread(self):
+        self._thread_sections.pop(threading.get_ident(), None)
+
+    def _sample_loop(self):
+        names = {}
+        while not self._stop.wait(SAMPLE_INTERVAL_SECONDS):
+            context = self._running_context
+            loop_section = context.get(_section) if context is not None else None
+            threads = list(self._thread_sections.items())
+            if not loop_section and not threads:
+                continue
+
+            frames = sys._current_frames()
+            with self._lock:
+                if loop_section and self._loop_thread in frames:
+                    self._add(loop_section, _collapse(frames[self._loop_thread], 'event-loop'))
+                for ident, section in threads:
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    if ident not in names:
+                        names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                    self._add(section, _collapse(frame, names.get(ident, f'thread-{ident}')))
+
+    def _add(self, section: str, stack: str):
+        samples = self._samples.get(section)
+        if samples is None:
+            samples = self._samples[section] = Counter()
+        samples[stack] += 1
+
+    def dump(self) -> List[Path]:
+        with self._lock:
+            samples, self._samples = self._samples, {}
+        if not samples:
+            return []
+
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        paths = []
+        for section, stacks in samples.items():
+            path = PROFILE_DIR / f"{section}_{stamp}.folded"
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths.append(path)
+            logger.info(f"Профиль {section}: {sum(stacks.values())} семплов записано в {path}")
+        return paths
+
+    def status(self) -> Dict:
+        with self._lock:
+            samples = {section: sum(stacks.values()) for section, stacks in self._samples.items()}
+        return {'enabled': self.enabled, 'samples': samples, 'slow_callbacks': list(self.slow_callbacks)}
+
+
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Profiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def profiled(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            profiler = get_profiler()
+            if not profiler.enabled:
+                return await func(*args, **kwargs)
+            with profiler.section(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -2,24 +2,27 @@ import asyncio
 from datetime import datetime, time, timedelta
 from aiogram import Bot
 from subscription_checker import check_and_remove_expired_subscriptions
+from api import DonationAlertsIncompleteFetchException
 from db import process_donations
+from health import get_health
 from logger_config import setup_logger
 
 logger = setup_logger(__name__)
 
+SYNC_INTERVAL_SECONDS = 3600
+
 
 async def schedule_hourly_donations_sync(access_token: str):
     logger.info("Планировщик синхронизации донатов запущен. Проверка каждый час")
+    health = get_health()
+    # Одна пропущенная синхронизация допустима, две подряд - признак зависания
+    health.expect('sync', SYNC_INTERVAL_SECONDS * 2 + 300)
     
     while True:
         try:
-            now = datetime.now()
             logger.info(f"Начало синхронизации донатов...")
 
-            end_date = now
-            start_date = now - timedelta(hours=1)
-
-            stats = process_donations(start_date, end_date, access_token)
+            stats = await process_donations(access_token)
 
             if stats:
                 logger.info(
@@ -27,16 +30,22 @@ async def schedule_hourly_donations_sync(access_token: str):
                     f"обработано: {stats['total']}, "
                     f"добавлено: {stats['inserted']}, "
                     f"обновлено: {stats['updated']}, "
+                    f"пропущено: {stats['skipped']}, "
                     f"ошибок: {stats['failed']}"
                 )
             else:
                 logger.info("Новых донатов не найдено")
+            # Отметка ставится только после полной загрузки: при недоступном DonationAlerts
+            # process_donations выбрасывает исключение, и проверка sync начинает проваливаться
+            health.beat('sync')
 
+        except DonationAlertsIncompleteFetchException as e:
+            logger.error(f"Синхронизация донатов не завершена, курсор не передвинут: {e}")
         except Exception as e:
             logger.error(f"Ошибка при синхронизации донатов: {e}", exc_info=True)
         
         logger.debug("Следующая синхронизация через 1 час...")
-        await asyncio.sleep(3600)
+        await asyncio.sleep(SYNC_INTERVAL_SECONDS)
 
 async def schedule_daily_check(bot: Bot, channel_id: str, check_time: time = time(12, 0)):
     logger.info(f"Планировщик проверки подписок запущен. Ежедневная проверка в {check_time.strftime('%H:%M')}")
@@ -69,25 +78,26 @@ async def schedule_daily_check(bot: Bot, channel_id: str, check_time: time = tim
 
 async def run_immediate_check(bot: Bot, channel_id: str):
     logger.info("Запуск немедленной проверки подписок...")
-    await check_and_remove_expired_subscriptions(bot, channel_id)
+    return await check_and_remove_expired_subscriptions(bot, channel_id)
 
 async def run_immediate_sync(access_token: str):
     logger.info("Запуск немедленной синхронизации донатов...")
-    now = datetime.now()
-    end_date = now
-    start_date = now - timedelta(hours=1)
 
     try:
-        stats = process_donations(start_date, end_date, access_token)
+        stats = await process_donations(access_token)
         if stats:
             logger.info(
                 f"Синхронизация завершена - "
                 f"обработано: {stats['total']}, "
                 f"добавлено: {stats['inserted']}, "
                 f"обновлено: {stats['updated']}, "
+                f"пропущено: {stats['skipped']}, "
                 f"ошибок: {stats['failed']}"
             )
         return stats
+    except DonationAlertsIncompleteFetchException:
+        # Администратор должен увидеть, что синхронизация не завершена, а не "новых донатов нет"
+        raise
     except Exception as e:
         logger.error(f"Ошибка при синхронизации: {e}", exc_info=True)
         return None
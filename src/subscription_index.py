@@ -0,0 +1,58 @@
+import sys
+import threading
+from typing import Iterable
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class SubscriptionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_username = {}
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, subscriptions: Iterable):
+        by_username = {}
+        for subscription in subscriptions:
+            if subscription.username:
+                by_username[subscription.username] = subscription
+
+        with self._lock:
+            self._by_username = by_username
+            self.loaded = True
+
+        logger.info(f"Индекс подписок загружен: {len(by_username)} пользователей")
+
+    def update(self, subscriptions: Iterable):
+        with self._lock:
+            for subscription in subscriptions:
+                if subscription.username:
+                    self._by_username[subscription.username] = subscription
+
+    def get(self, username: str):
+        with self._lock:
+            subscription = self._by_username.get(username)
+            if subscription is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return subscription
+
+    def stats(self) -> dict:
+        with self._lock:
+            memory = sys.getsizeof(self._by_username)
+            for username, subscription in self._by_username.items():
+                memory += sys.getsizeof(username) + sys.getsizeof(subscription)
+                memory += sum(sys.getsizeof(value) for value in subscription)
+
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._by_username),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'memory_bytes': memory
+            }
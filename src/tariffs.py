@@ -0,0 +1,139 @@
+import calendar
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+DAYS_PER_MONTH = 30
+
+
+def parse_tariffs(spec: str) -> List[Tuple[float, int]]:
+    tariffs = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+
+        price, months = item.split(':')
+        price, months = float(price), int(months)
+        if price <= 0 or months <= 0:
+            raise ValueError(f"Некорректный тариф: {item}")
+        tariffs.append((price, months))
+
+    if not tariffs:
+        raise ValueError("Не задано ни одного тарифа")
+
+    # Сначала самые выгодные тарифы (наименьшая цена за месяц)
+    return sorted(tariffs, key=lambda tariff: (tariff[0] / tariff[1], -tariff[0]))
+
+
+TARIFFS = parse_tariffs(os.getenv('TARIFFS', '200:1'))
+PARTIAL_CREDIT = os.getenv('TARIFF_PARTIAL_CREDIT', 'false').lower() in ('1', 'true', 'yes')
+
+
+def duration_for_amount(amount, tariffs=None, partial_credit=None) -> Tuple[int, int]:
+    tariffs = tariffs or TARIFFS
+    partial_credit = PARTIAL_CREDIT if partial_credit is None else partial_credit
+
+    remainder = max(float(amount or 0), 0.0)
+    months = 0
+    for price, tariff_months in tariffs:
+        count = int(remainder // price)
+        months += count * tariff_months
+        remainder -= count * price
+
+    days = 0
+    if partial_credit and remainder > 0:
+        month_price = min(price / tariff_months for price, tariff_months in tariffs)
+        days = int(remainder / month_price * DAYS_PER_MONTH)
+
+    return months, days
+
+
+def add_months(date: datetime, months: int) -> datetime:
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+
+def _to_datetime(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str) and value:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return None
+
+
+def calculate_expiries(
+    pairs: Iterable[Tuple[object, Sequence[float]]],
+    now: Optional[datetime] = None
+) -> List[datetime]:
+    now = now or datetime.now()
+    durations = {}
+    expiries = []
+
+    for base_date, amounts in pairs:
+        expiry = _to_datetime(base_date) or now
+        # Каждый донат оценивается отдельно и продлевает срок по очереди, поэтому результат
+        # не зависит от того, пришли донаты одной пачкой или по одному
+        for amount in amounts:
+            duration = durations.get(amount)
+            if duration is None:
+                duration = durations[amount] = duration_for_amount(amount)
+
+            current = now.astimezone(expiry.tzinfo) if expiry.tzinfo else now.replace(tzinfo=None)
+            # Продление истекшей подписки начинается с текущего момента, а не с даты окончания
+            base = expiry if expiry >= current else current
+
+            months, days = duration
+            expiry = add_months(base, months) if months else base
+            if days:
+                expiry += timedelta(days=days)
+        expiries.append(expiry)
+
+    return expiries
+
+
+def calculate_expiry(base_date, amount, now: Optional[datetime] = None) -> datetime:
+    return calculate_expiries([(base_date, [amount])], now)[0]
+
+
+def _plural(number: int, one: str, few: str, many: str) -> str:
+    if number % 10 == 1 and number % 100 != 11:
+        return one
+    if 2 <= number % 10 <= 4 and not 12 <= number % 100 <= 14:
+        return few
+    return many
+
+
+def format_duration(months: int, days: int = 0) -> str:
+    parts = []
+    if months:
+        parts.append(f"{months} {_plural(months, 'месяц', 'месяца', 'месяцев')}")
+    if days:
+        parts.append(f"{days} {_plural(days, 'день', 'дня', 'дней')}")
+    return ' '.join(parts) or '0 дней'
+
+
+def _format_price(price: float) -> str:
+    return f"{price:g}"
+
+
+def tariff_lines(examples: int = 3) -> List[str]:
+    base_price = min(price for price, _ in TARIFFS)
+    amounts = {price for price, _ in TARIFFS}
+    amounts.update(base_price * multiplier for multiplier in range(1, examples + 1))
+
+    return [
+        f"{_format_price(amount)} руб = {format_duration(*duration_for_amount(amount))}"
+        for amount in sorted(amounts)
+    ]
+
+
+def tariff_summary() -> str:
+    if len(TARIFFS) == 1:
+        price, months = TARIFFS[0]
+        return f"Каждые {_format_price(price)} рублей продлевают срок подписки на {format_duration(months)}."
+
+    return "Тарифы: " + ", ".join(tariff_lines()) + "."
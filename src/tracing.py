@@ -0,0 +1,175 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from logger_config import DailyRotatingFileHandler, add_record_filter, setup_logger
+
+logger = setup_logger(__name__)
+
+SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_DIR = Path(os.getenv('TRACE_DIR', os.getenv('LOG_DIR', '/app/logs')))
+
+# Текущий span; при copy_context() попадает в потоки БД вместе с остальным контекстом
+_current_span: ContextVar[Optional['Span']] = ContextVar('trace_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attrs', 'start', 'duration', 'error', '_started')
+
+    def __init__(self, name: str, trace_id: Optional[str], parent_id: Optional[str], attrs: Dict):
+        self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict:
+        data = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'attrs': self.attrs
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+class TraceLogFilter(logging.Filter):
+    # Строки логов внутри трассируемого обновления получают trace_id для связи со spans
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = _current_span.get()
+        if span is not None and not hasattr(record, 'trace_id'):
+            record.trace_id = span.trace_id
+            record.msg = f"{record.msg} [trace={span.trace_id}]"
+        return True
+
+
+class Tracer:
+    def __init__(self, sample_rate: Optional[float] = None):
+        self.sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+        self._queue: Optional[queue.SimpleQueue] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._filter_installed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self._listener is not None
+
+    def start(self, trace_dir: Optional[Path] = None):
+        if self.sample_rate <= 0 or self._listener is not None:
+            return
+
+        trace_dir = trace_dir or TRACE_DIR
+        trace_dir.mkdir(parents=True, exist_ok=True)
+        handler = DailyRotatingFileHandler(trace_dir, 'traces', suffix='.jsonl')
+        handler.setFormatter(_JsonFormatter())
+
+        # Запись на диск и сериализация JSON выполняются в отдельном потоке
+        self._queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+        if not self._filter_installed:
+            add_record_filter(TraceLogFilter())
+            self._filter_installed = True
+        logger.info(f"Трассировка включена: доля обновлений {self.sample_rate}, файлы {trace_dir}/traces_*.jsonl")
+
+    def stop(self):
+        if self._listener is None:
+            return
+
+        listener, self._listener = self._listener, None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        self._queue = None
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        # Корневой span: решение о семплировании принимается один раз на обновление
+        if self._listener is None or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            yield None
+            return
+
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else None, parent.span_id if parent else None, attrs)
+        with self._activate(span):
+            yield span
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        # Дочерний span создаётся только внутри уже трассируемого обновления
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+
+        span = Span(name, parent.trace_id, parent.span_id, attrs)
+        with self._activate(span):
+            yield span
+
+    @contextmanager
+    def _activate(self, span: Span):
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.duration = time.perf_counter() - span._started
+            self._export(span)
+
+    def _export(self, span: Span):
+        span_queue = self._queue
+        if span_queue is not None:
+            span_queue.put(logging.makeLogRecord({'msg': span.to_dict()}))
+
+
+class TelegramTracingMiddleware(BaseRequestMiddleware):
+    def __init__(self, tracer: 'Tracer'):
+        self.tracer = tracer
+
+    async def __call__(self, make_request, bot: Bot, method):
+        with self.tracer.span(f"telegram.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
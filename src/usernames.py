@@ -0,0 +1,71 @@
+import re
+from typing import Iterable, List, Optional
+
+MENTION_RE = re.compile(r'@(\w+)')
+
+KEYWORD_PATTERNS = [
+    (('username', 'user', 'ник', 'имя пользователя'), re.compile(r'(?:username|user|ник|имя пользователя)[\s:=]+@?(\w+)', re.IGNORECASE)),
+    (('telegram', 'tg'), re.compile(r'(?:telegram|tg)[\s:=]+@?(\w+)', re.IGNORECASE)),
+]
+
+WORD_STRIP = '.,!?;:()[]{}"\' '
+WORD_RE = re.compile(
+    r'(?<!\S)[' + re.escape(WORD_STRIP) + r']*@*([a-zA-Z0-9_]{5,32})[' + re.escape(WORD_STRIP) + r']*(?!\S)'
+)
+
+
+def _extract_keyword(message_text: str) -> Optional[str]:
+    # Регулярное выражение запускается, только если ключевое слово вообще есть в тексте
+    folded = message_text.casefold()
+    for keywords, pattern in KEYWORD_PATTERNS:
+        if not any(keyword in folded for keyword in keywords):
+            continue
+
+        match = pattern.search(message_text)
+        if match:
+            username = match.group(1)
+            if len(username) >= 5 and username.replace('_', '').isalnum():
+                return username
+
+    return None
+
+
+def extract_username(message_text) -> Optional[str]:
+    if not message_text:
+        return None
+
+    if '@' in message_text:
+        mention_match = MENTION_RE.search(message_text)
+        if mention_match:
+            return mention_match.group(1)
+
+    username = _extract_keyword(message_text)
+    if username:
+        return username
+
+    for match in WORD_RE.finditer(message_text):
+        word = match.group(1)
+        if not word.isdigit() and word.strip('_'):
+            return word
+
+    return None
+
+
+def extract_usernames(messages: Iterable) -> List[Optional[str]]:
+    return [extract_username(message_text) for message_text in messages]
+
+
+def normalize_username(username) -> Optional[str]:
+    if not username or not isinstance(username, str):
+        return None
+
+    username = username.strip().lstrip('@').lower()
+    return username or None
+
+
+def username_key(message_text) -> Optional[str]:
+    return normalize_username(extract_username(message_text))
+
+
+def username_keys(messages: Iterable) -> List[Optional[str]]:
+    return [normalize_username(username) for username in extract_usernames(messages)]
@@ -0,0 +1,147 @@
+import asyncio
+import hmac
+import os
+import re
+import time
+from typing import List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Допустимые символы secret_token по документации Bot API
+SECRET_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,256}')
+QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))
+DRAIN_TIMEOUT = 10
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret: str,
+        path: str = '/webhook',
+        queue_size: Optional[int] = None,
+        workers: Optional[int] = None
+    ):
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET не может быть пустым")
+        if not SECRET_PATTERN.fullmatch(secret):
+            raise ValueError("WEBHOOK_SECRET должен состоять из 1-256 символов A-Z, a-z, 0-9, _ и -")
+
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret = secret.encode()
+        self.path = path
+        self.workers = max(1, workers or WORKERS)
+        # Ограниченная очередь: при переполнении Telegram получает 503 и повторит доставку позже
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or QUEUE_SIZE)
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+        self.stats = {'received': 0, 'processed': 0, 'rejected': 0, 'unauthorized': 0, 'failed': 0}
+
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # Сравнение байтов: compare_digest для строк с не-ASCII символами выбрасывает TypeError
+        token = request.headers.get(SECRET_HEADER, '').encode('utf-8', 'replace')
+        if not hmac.compare_digest(token, self.secret):
+            self.stats['unauthorized'] += 1
+            logger.warning(f"Webhook-запрос с неверным секретом от {request.remote}")
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            return web.Response(status=400)
+
+        try:
+            self.queue.put_nowait((update, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            logger.warning(f"Очередь обновлений переполнена ({self.queue.maxsize}), обновление {update.update_id} отклонено")
+            return web.Response(status=503)
+
+        self.stats['received'] += 1
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update, received_at = await self.queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+                self.stats['processed'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Ошибка обработки обновления {update.update_id}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+                logger.debug("Обновление %s обработано за %.3f с", update.update_id, time.perf_counter() - received_at)
+
+    async def start(self, host: str, port: int):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(
+            f"Webhook-сервер запущен на {host}:{port}{self.path} "
+            f"(обработчиков: {self.workers}, очередь: {self.queue.maxsize})"
+        )
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        try:
+            await asyncio.wait_for(self.queue.join(), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не обработано обновлений при остановке: {self.queue.qsize()}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Webhook-сервер остановлен: {self.stats}")
+
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    url: str,
+    secret: str,
+    host: str = '0.0.0.0',
+    port: int = 8080,
+    path: str = '/webhook'
+):
+    server = WebhookServer(dispatcher, bot, secret, path)
+    await server.start(host, port)
+    await dispatcher.emit_startup(bot=bot)
+
+    await bot.set_webhook(
+        url=url.rstrip('/') + path,
+        secret_token=secret,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+        max_connections=min(100, server.workers * 2)
+    )
+    logger.info(f"Webhook установлен: {url.rstrip('/')}{path}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        try:
+            await bot.delete_webhook()
+            logger.info("Webhook удалён")
+        except Exception as e:
+            logger.error(f"Не удалось удалить webhook: {e}")
+        await server.stop()
+        await dispatcher.emit_shutdown(bot=bot)
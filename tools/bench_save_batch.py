@@ -0,0 +1,143 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(SRC_DIR))
+os.environ.setdefault('LOG_DIR', tempfile.mkdtemp(prefix='bench_logs_'))
+
+import logging
+from db import DonationDB, _expires_at
+from db_connection import close_connections
+from usernames import username_key
+
+
+def make_donations(count, users, seed=42):
+    rng = random.Random(seed)
+    donations = []
+    for donation_id in range(1, count + 1):
+        user = rng.randrange(users)
+        donations.append({
+            'id': donation_id,
+            'message': f"@donor_{user:06d} спасибо за стрим!",
+            'amount': rng.choice([200, 200, 400, 600, 1000]),
+            'created_at': '2025-01-01 12:00:00'
+        })
+    return donations
+
+
+def legacy_save_batch(db, donations):
+    # Построчный путь до перехода на upsert: SELECT + UPDATE/INSERT на каждый донат
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        for donation in donations:
+            message = donation['message']
+            amount = donation['amount']
+            last_date = donation['created_at']
+            username = username_key(message)
+
+            cursor.execute('SELECT 1 FROM processed_donations WHERE donation_id = ?', (donation['id'],))
+            if cursor.fetchone():
+                continue
+
+            if username:
+                cursor.execute('SELECT id, amount, sub FROM donations WHERE username = ?', (username,))
+            else:
+                cursor.execute('SELECT id, amount, sub FROM donations WHERE message = ?', (message,))
+            existing = cursor.fetchone()
+
+            if existing:
+                new_sub = db._calculate_sub_date(existing[2] or datetime.now(), amount)
+                cursor.execute(
+                    'UPDATE donations SET amount = ?, last_date = ?, sub = ?, expires_at = ?, '
+                    'updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                    (existing[1] + amount, last_date, new_sub, _expires_at(new_sub), existing[0])
+                )
+            else:
+                sub = db._calculate_sub_date(datetime.now(), amount)
+                cursor.execute(
+                    'INSERT INTO donations (message, username, amount, last_date, sub, expires_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (message, username, amount, last_date, sub, _expires_at(sub))
+                )
+            cursor.execute('INSERT INTO processed_donations (donation_id) VALUES (?)', (donation['id'],))
+        conn.commit()
+
+
+def subscriptions(db):
+    with db._read_connection() as conn:
+        return {row[0]: row[1:] for row in conn.execute('SELECT username, amount, expires_at FROM donations')}
+
+
+def check_batch_invariance(count=300, users=20, tolerance=60):
+    # Срок подписки не должен зависеть от разбиения на пачки: по одному (поток донатов)
+    # и одной пачкой (ежечасная синхронизация) результат одинаковый
+    rng = random.Random(7)
+    donations = [
+        {
+            'id': donation_id,
+            'message': f"@donor_{rng.randrange(users):06d}",
+            'amount': rng.choice([100, 100, 150, 200, 300, 400]),
+            'created_at': f"2025-01-01T12:{donation_id // 60 % 60:02d}:{donation_id % 60:02d}"
+        }
+        for donation_id in range(1, count + 1)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        single = DonationDB(os.path.join(tmp, 'single.db'))
+        for donation in donations:
+            single.save_donations_batch([donation])
+        batched = DonationDB(os.path.join(tmp, 'batched.db'))
+        batched.save_donations_batch(list(reversed(donations)))
+        expected, actual = subscriptions(single), subscriptions(batched)
+        close_connections()
+
+    mismatches = [
+        username for username in expected
+        if actual.get(username) is None
+        or expected[username][0] != actual[username][0]
+        or abs(expected[username][1] - actual[username][1]) > tolerance
+    ]
+    if mismatches:
+        print(f"Срок подписки зависит от разбиения на пачки: {mismatches[:5]}")
+        return False
+    print(f"Разбиение на пачки не влияет на срок подписки ({len(expected)} пользователей)")
+    return True
+
+
+def run(label, save, donations):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DonationDB(os.path.join(tmp, 'bench.db'))
+        started = time.perf_counter()
+        save(db, donations)
+        elapsed = time.perf_counter() - started
+        close_connections()
+
+    print(f"{label:<10} {len(donations):>7} донатов за {elapsed:7.2f} с ({len(donations) / elapsed:>9.0f} донатов/с)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение построчного и пакетного сохранения донатов")
+    parser.add_argument('--donations', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    if not check_batch_invariance():
+        sys.exit(1)
+
+    donations = make_donations(args.donations, args.users)
+
+    before = run('построчно', legacy_save_batch, donations)
+    after = run('upsert', lambda db, items: db.save_donations_batch(items), donations)
+    print(f"Ускорение: x{before / after:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(SRC_DIR))
+os.environ.setdefault('LOG_DIR', tempfile.mkdtemp(prefix='bench_logs_'))
+
+from usernames import extract_username, extract_usernames
+
+CORPUS = Path(__file__).resolve().parent / 'username_corpus.jsonl'
+
+
+def legacy_extract_username(message_text):
+    # Прежняя реализация: несколько re.search без предкомпиляции и re.match на каждое слово
+    if not message_text:
+        return None
+
+    mention_match = re.search(r'@(\w+)', message_text)
+    if mention_match:
+        return mention_match.group(1)
+
+    patterns = [
+        r'(?:username|user|ник|имя пользователя)[\s:=]+(@?\w+)',
+        r'(?:telegram|tg)[\s:=]+(@?\w+)',
+    ]
+
+    for pattern in patterns:
+        match = re.search(pattern, message_text, re.IGNORECASE)
+        if match:
+            username = match.group(1).lstrip('@')
+            if len(username) >= 5 and username.replace('_', '').isalnum():
+                return username
+
+    for word in message_text.split():
+        clean_word = word.strip('.,!?;:()[]{}"\' ').lstrip('@')
+
+        if (5 <= len(clean_word) <= 32 and clean_word.replace('_', '').isalnum() and not clean_word.isdigit() and re.match(r'^[a-zA-Z0-9_]+$', clean_word)):
+            return clean_word
+
+    return None
+
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check(corpus):
+    failures = 0
+    for case in corpus:
+        for name, extractor in (('legacy', legacy_extract_username), ('current', extract_username)):
+            result = extractor(case['message'])
+            if result != case['expected']:
+                failures += 1
+                print(f"[{name}] {case['message']!r}: ожидалось {case['expected']!r}, получено {result!r}")
+    return failures
+
+
+def measure(func, messages, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(messages)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Корректность и скорость извлечения username из сообщений донатов')
+    parser.add_argument('--corpus', default=str(CORPUS))
+    parser.add_argument('--messages', type=int, default=200000, help='размер выборки для замера скорости')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    failures = check(corpus)
+    print(f"Корпус: {len(corpus)} сообщений, расхождений: {failures}")
+
+    texts = [case['message'] for case in corpus]
+    messages = (texts * (args.messages // len(texts) + 1))[:args.messages]
+
+    legacy = measure(lambda batch: [legacy_extract_username(text) for text in batch], messages, args.repeat)
+    current = measure(extract_usernames, messages, args.repeat)
+
+    print(f"Прежний извлекатель: {legacy:.3f} с ({len(messages) / legacy:,.0f} сообщений/с)")
+    print(f"Текущий извлекатель: {current:.3f} с ({len(messages) / current:,.0f} сообщений/с)")
+    print(f"Ускорение: {legacy / current:.2f}x")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(SRC_DIR))
+os.environ.setdefault('LOG_DIR', tempfile.mkdtemp(prefix='bench_logs_'))
+
+import logging
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'bench-secret'
+
+
+def make_update(update_id):
+    # Время отправки в тексте позволяет обработчику посчитать полную задержку от POST до завершения
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': 1000 + update_id % 50, 'type': 'private'},
+            'from': {'id': 1000 + update_id % 50, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench_{update_id % 50}'},
+            'text': f'{time.perf_counter()}'
+        }
+    }
+
+
+def build_dispatcher(latencies, handler_delay):
+    router = Router()
+
+    @router.message()
+    async def handle(message: Message):
+        if handler_delay:
+            await asyncio.sleep(handler_delay)
+        latencies.append(time.perf_counter() - float(message.text))
+
+    dispatcher = Dispatcher()
+    dispatcher.include_router(router)
+    return dispatcher
+
+
+async def post_updates(url, count, concurrency):
+    statuses = {}
+    next_id = iter(range(1, count + 1))
+
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: SECRET}) as session:
+        async def client():
+            for update_id in next_id:
+                async with session.post(url, json=make_update(update_id)) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    return statuses
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(args):
+    latencies = []
+    bot = Bot(token='123456:BENCH')
+    dispatcher = build_dispatcher(latencies, args.handler_delay / 1000)
+    server = WebhookServer(dispatcher, bot, SECRET, queue_size=args.queue_size, workers=args.workers)
+    await server.start('127.0.0.1', args.port)
+
+    started = time.perf_counter()
+    statuses = await post_updates(f'http://127.0.0.1:{args.port}/webhook', args.updates, args.concurrency)
+    await server.queue.join()
+    elapsed = time.perf_counter() - started
+
+    await server.stop()
+    await bot.session.close()
+
+    print(f"Обновлений: {args.updates}, клиентов: {args.concurrency}, обработчиков: {args.workers}, очередь: {args.queue_size}")
+    print(f"Ответы сервера: {dict(sorted(statuses.items()))}")
+    print(f"Обработано: {len(latencies)} за {elapsed:.2f} с ({len(latencies) / elapsed:.0f} обновлений/с)")
+    if latencies:
+        print(
+            f"Задержка до завершения обработчика, мс: "
+            f"p50={percentile(latencies, 0.5) * 1000:.1f} "
+            f"p95={percentile(latencies, 0.95) * 1000:.1f} "
+            f"p99={percentile(latencies, 0.99) * 1000:.1f} "
+            f"max={max(latencies) * 1000:.1f} "
+            f"среднее={statistics.mean(latencies) * 1000:.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочная проверка webhook-режима синтетическими обновлениями')
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--queue-size', type=int, default=1000)
+    parser.add_argument('--handler-delay', type=float, default=0.0, help='имитация работы обработчика, мс')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
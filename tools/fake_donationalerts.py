@@ -0,0 +1,141 @@
+"""Локальная имитация DonationAlerts: REST API и Centrifugo-вебсокет.
+
+Запуск:
+    python tools/fake_donationalerts.py --port 8765
+
+Бот подключается к имитации через переменные окружения:
+    DA_API_URL=http://127.0.0.1:8765/api/v1
+    DA_CENTRIFUGO_URL=ws://127.0.0.1:8765/connection/websocket
+
+Управление:
+    POST /emit        - опубликовать донат (JSON доната в теле, id и дата проставляются сами)
+    POST /disconnect  - оборвать все вебсокет-соединения (проверка переподключения)
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime
+
+from aiohttp import WSMsgType, web
+
+USER_ID = 1
+CHANNEL = f"$alerts:donation_{USER_ID}"
+
+
+class FakeDonationAlerts:
+    def __init__(self, per_page=50):
+        self.per_page = per_page
+        self.donations = []
+        self.sockets = set()
+        self.next_id = 1
+        self.connects = 0
+        self.runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/api/v1/user/oauth', self.user)
+        self.app.router.add_get('/api/v1/alerts/donations', self.list_donations)
+        self.app.router.add_post('/api/v1/centrifuge/subscribe', self.subscribe)
+        self.app.router.add_get('/connection/websocket', self.websocket)
+        self.app.router.add_post('/emit', self.emit_handler)
+        self.app.router.add_post('/disconnect', self.disconnect_handler)
+
+    async def user(self, request):
+        return web.json_response({'data': {'id': USER_ID, 'name': 'fake', 'socket_connection_token': 'socket-token'}})
+
+    async def list_donations(self, request):
+        page = int(request.query.get('page', 1))
+        ordered = sorted(self.donations, key=lambda donation: -donation['id'])
+        chunk = ordered[(page - 1) * self.per_page:page * self.per_page]
+        last_page = max(1, (len(ordered) + self.per_page - 1) // self.per_page)
+        return web.json_response({
+            'data': chunk,
+            'links': {'next': 'next' if page < last_page else None},
+            'meta': {'current_page': page, 'last_page': last_page}
+        })
+
+    async def subscribe(self, request):
+        payload = await request.json()
+        return web.json_response({
+            'channels': [{'channel': channel, 'token': f"token-{channel}"} for channel in payload['channels']]
+        })
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connects += 1
+
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            command = json.loads(message.data)
+            params = command.get('params', {})
+            if command.get('method') == 1:
+                if params.get('token') != f"token-{params.get('channel')}":
+                    await ws.send_json({'id': command['id'], 'error': {'code': 103, 'message': 'permission denied'}})
+                    continue
+                self.sockets.add(ws)
+                await ws.send_json({'id': command['id'], 'result': {}})
+            else:
+                await ws.send_json({'id': command['id'], 'result': {'client': f"client-{self.connects}", 'version': '2.8.0'}})
+
+        self.sockets.discard(ws)
+        return ws
+
+    async def emit(self, donation, publish=True):
+        donation = {
+            'id': self.next_id,
+            'name': 'donation',
+            'username': 'fake',
+            'currency': 'RUB',
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            **donation
+        }
+        self.next_id = max(self.next_id, donation['id']) + 1
+        self.donations.append(donation)
+
+        if publish:
+            publication = {'result': {'channel': CHANNEL, 'data': {'seq': donation['id'], 'data': donation}}}
+            for ws in list(self.sockets):
+                await ws.send_str(json.dumps(publication))
+        return donation
+
+    async def emit_handler(self, request):
+        return web.json_response(await self.emit(await request.json()))
+
+    async def disconnect(self):
+        for ws in list(self.sockets):
+            await ws.close()
+        self.sockets.clear()
+
+    async def disconnect_handler(self, request):
+        await self.disconnect()
+        return web.json_response({'ok': True})
+
+    async def start(self, host='127.0.0.1', port=8765):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        await self.disconnect()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = FakeDonationAlerts()
+    await server.start(args.host, args.port)
+    print(f"Имитация DonationAlerts: http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+import argparse
+import glob
+import json
+import os
+from collections import defaultdict
+
+
+def load_spans(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                traces[span['trace_id']].append(span)
+    return traces
+
+
+def percentile(values, q):
+    # Ближайший ранг: p99 - это реальная длительность одного из обновлений, без интерполяции
+    index = max(0, min(len(values) - 1, int(round(q / 100 * len(values))) - 1))
+    return values[index]
+
+
+def root_of(spans):
+    return next((span for span in spans if span['parent_id'] is None), None)
+
+
+def root_key(root):
+    handler = root['attrs'].get('handler')
+    return f"{root['name']} [{handler}]" if handler else root['name']
+
+
+def breakdown(spans):
+    # Время листовых операций по типу (db.*, telegram.*, da.*); update.* и handler.* - обёртки
+    totals = defaultdict(float)
+    for span in spans:
+        kind = span['name'].split('.', 1)[0]
+        if kind in ('update', 'handler'):
+            continue
+        totals[span['name']] += span['duration_ms']
+    return totals
+
+
+def report(traces, slowest):
+    groups = defaultdict(list)
+    for spans in traces.values():
+        root = root_of(spans)
+        if root is not None:
+            groups[root_key(root)].append((root['duration_ms'], spans))
+
+    print(f"{'корневой span':<45} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for key, items in sorted(groups.items(), key=lambda item: -len(item[1])):
+        durations = sorted(duration for duration, _ in items)
+        print(
+            f"{key:<45} {len(durations):>6} {percentile(durations, 50):>9.1f} {percentile(durations, 95):>9.1f} "
+            f"{percentile(durations, 99):>9.1f} {durations[-1]:>9.1f}"
+        )
+
+    print("\nСамые медленные обновления (мс):")
+    everything = sorted((item for items in groups.values() for item in items), key=lambda item: -item[0])
+    for duration, spans in everything[:slowest]:
+        root = root_of(spans)
+        totals = breakdown(spans)
+        own = max(0.0, duration - sum(totals.values()))
+        parts = ', '.join(f"{name} {value:.1f}" for name, value in sorted(totals.items(), key=lambda item: -item[1]))
+        errors = [span['name'] for span in spans if span.get('error')]
+        print(f"  {root['trace_id']} {root_key(root)}: {duration:.1f}")
+        print(f"    {parts or 'нет вложенных операций'}; прочее (код обработчика, очередь event loop) {own:.1f}")
+        if errors:
+            print(f"    ошибки: {', '.join(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перцентили длительности обновлений и разбор самых медленных по трассам')
+    parser.add_argument('paths', nargs='*', help='файлы traces_*.jsonl (по умолчанию все из LOG_DIR)')
+    parser.add_argument('--slowest', type=int, default=10, help='сколько самых медленных обновлений разобрать')
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(os.getenv('TRACE_DIR', os.getenv('LOG_DIR', 'logs')), 'traces_*.jsonl')))
+    if not paths:
+        parser.error('не найдено файлов трасс')
+
+    traces = load_spans(paths)
+    print(f"Трасс: {len(traces)}, файлов: {len(paths)}\n")
+    report(traces, args.slowest)
+
+
+if __name__ == '__main__':
+    main()